@@ -0,0 +1,80 @@
+# Common imports
+import os
+import sys
+import time
+import argparse
+from tempfile import mkstemp
+import numpy as np
+
+# Local imports
+sys.path.append("../src")
+import table_reader
+from table_reader import read_table
+from Chain import _load_chain_file
+
+# Parsing input
+parser = argparse.ArgumentParser(
+    description="Compare the speed of 'numpy.loadtxt', the chunked parser " +
+                "of 'read_table' and the loading of a chain file by 'Chain' " +
+                "reading a synthetic MontePython-like chain file.")
+parser.add_argument("-r", "--rows", type=int, dest="rows", default=10**7,
+    metavar="Number of rows of the synthetic chain (default: 10^7)")
+parser.add_argument("-c", "--columns", type=int, dest="columns", default=8,
+    metavar="Number of parameters (plus '#' and 'mloglik') (default: 8)")
+parser.add_argument("-f", "--file", type=str, dest="file", default=None,
+    metavar="Use this chain file instead of generating a synthetic one.")
+args = parser.parse_args()
+
+# Generating the chain, in blocks to keep the memory bounded
+if args.file:
+    chain_file = args.file
+else:
+    handle, chain_file = mkstemp(suffix=".txt")
+    print("Writing a synthetic chain of %d rows to %s ..."%(args.rows, chain_file))
+    block = 10**5
+    with os.fdopen(handle, "w") as cfile:
+        for start in range(0, args.rows, block):
+            n = min(block, args.rows - start)
+            points = np.random.normal(size=(n, args.columns + 2))
+            points[:, 0] = np.random.randint(1, 10, size=n)
+            points[:, 1] = 5000 + np.abs(points[:, 1])
+            np.savetxt(cfile, points, fmt="%.6g", delimiter="\t")
+print("File size: %.1f MB"%(os.path.getsize(chain_file)/1e6))
+
+def read_table_chunked(filename):
+    """
+    'read_table' using its own chunked parser even where, with numpy >= 1.23,
+    it would defer to 'numpy.loadtxt'.
+    """
+    c_loadtxt = table_reader._C_LOADTXT
+    table_reader._C_LOADTXT = False
+    try:
+        return read_table(filename)
+    finally:
+        table_reader._C_LOADTXT = c_loadtxt
+
+# Timing
+try:
+    timings = {}
+    tables = {}
+    readers = [("numpy.loadtxt", lambda f: np.loadtxt(f, ndmin=2)),
+               ("chunked parser", read_table_chunked),
+               ("Chain loading", lambda f: _load_chain_file(
+                   f, np.ones(tables["numpy.loadtxt"].shape[1]))[0])]
+    if table_reader._C_LOADTXT:
+        print("(numpy >= 1.23: 'read_table' uses 'numpy.loadtxt' itself)")
+    for name, reader in readers:
+        start = time.time()
+        tables[name] = reader(chain_file)
+        timings[name] = time.time() - start
+        print("%-14s: %8.2f s  (%.2e rows/s)"%(
+            name, timings[name], tables[name].shape[0]/timings[name]))
+    for name in tables:
+        assert np.array_equal(tables[name], tables["numpy.loadtxt"]), (
+            "The results of '%s' and 'numpy.loadtxt' differ!"%name)
+    for name in ["chunked parser", "Chain loading"]:
+        print("Speedup of the %s: %.1fx"%(
+            name, timings["numpy.loadtxt"]/timings[name]))
+finally:
+    if not args.file:
+        os.remove(chain_file)
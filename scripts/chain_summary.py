@@ -0,0 +1,74 @@
+# Common imports
+import os
+import sys
+import time
+import argparse
+from multiprocessing import Pool
+
+# Parsing input
+parser = argparse.ArgumentParser(
+    description="Write the summary statistics of some MontePython chains " +
+                "(best fit, mean, sigma, 68% and 95% bounds, R-1) as " +
+                "'.h_info', '.v_info' and '.tex' files, processing the chains " +
+                "in parallel.")
+parser.add_argument("-o", "--output", type=str, dest="output", default=None,
+    metavar=("Folder in which the files are written, as '<chain name>.*' " +
+             "(default: the folder of each chain)."))
+parser.add_argument("-p", "--params", type=str, dest="params", nargs="+",
+    default=None,
+    metavar="Parameters to include (default: all)")
+parser.add_argument("-n", "--n-workers", type=int, dest="n_workers", default=1,
+    metavar="Number of processes among which the chains are distributed (default: 1)")
+parser.add_argument("folders", type=str, nargs="+",
+    metavar="Folders of the chains.")
+args = parser.parse_args()
+
+# Local imports
+sys.path.append("../src")
+from Chain import Chain
+
+def summarise(folder):
+    """
+    Writes the summary of the chain in the given folder. Returns the files
+    written, the time spent loading the chain and computing the summary, and
+    the error message, if it failed.
+    """
+    start = loaded = time.time()
+    files = []
+    try:
+        chain = Chain(folder)
+        loaded = time.time()
+        base_folder = args.output if args.output else folder
+        files = chain.write_summary(os.path.join(base_folder, chain.name()),
+                                    params=args.params)
+        error = None
+    except Exception as e:
+        error = "%s: %s"%(type(e).__name__, e)
+    return folder, files, loaded - start, time.time() - loaded, error
+
+if __name__ == "__main__":
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    n_workers = max(1, min(args.n_workers, len(args.folders)))
+    start = time.time()
+    failed = 0
+    pool = Pool(n_workers) if n_workers > 1 else None
+    try:
+        if pool:
+            results = pool.imap_unordered(summarise, args.folders)
+        else:
+            results = (summarise(folder) for folder in args.folders)
+        # Reported as they finish
+        for folder, files, t_load, t_stats, error in results:
+            print("%-40s load: %7.2f s   stats: %7.2f s   %s"%(
+                folder, t_load, t_stats,
+                "FAILED: " + error if error else ", ".join(files)))
+            sys.stdout.flush()
+            failed += bool(error)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    print("%d chains (%d failed) in %.2f s with %d worker(s)"%(
+        len(args.folders), failed, time.time() - start, n_workers))
+    sys.exit(1 if failed else 0)
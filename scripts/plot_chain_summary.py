@@ -1,59 +1,149 @@
 # Common imports
 import sys
+import time
 import argparse
 import json
-import matplotlib.pyplot as plt
-
-# Local imports
-sys.path.append("../src")
-from Chain import Chain
-from plot_lik import plot_lik_2D
+from collections import OrderedDict
+from multiprocessing import Pool
+import matplotlib
 
 # Parsing input
 parser = argparse.ArgumentParser(
-    description="Plot the likelihood sampling of a chain in a 2D projection.")
-parser.add_argument("-k", "--keywords", type=str, dest="kwargs",
+    description="Plot the likelihood sampling of a chain in a 2D projection " +
+                "(profile, mean and marginal likelihoods), or, with a " +
+                "manifest, a batch of such plots.")
+parser.add_argument("-k", "--keywords", type=str, dest="kwargs", default="{}",
     metavar=("Optional list of keyword arguments of the 'plot_lik_2D' function, "+
              """as a dictionary; e.g. '{"format":"-loglik"}'. """ +
              "The order of the quotes is important!"))
 parser.add_argument("-p", "--params", type=str, dest="params", nargs=2,
-    required=True,
+    default=None,
     metavar="List of 2 parameters to plot")
 parser.add_argument("-o", "--output", type=str, dest="output", nargs=1,
     default=None,
     metavar="Optional file in which to store the plot.")
-parser.add_argument("folders", type=str, nargs="+",
+parser.add_argument("-m", "--manifest", type=str, dest="manifest", default=None,
+    metavar=("JSON file with a list of jobs, each a dictionary with keys " +
+             "'folders' (list), 'params' (list of 2), 'output' (file name) " +
+             "and, optionally, 'keywords' (as in '-k', which sets the " +
+             "default ones). The plots are saved, never shown."))
+parser.add_argument("-n", "--n-workers", type=int, dest="n_workers", default=1,
+    metavar="Number of processes rendering the jobs of a manifest (default: 1)")
+parser.add_argument("folders", type=str, nargs="*",
     metavar="Folders of the chains to be plotted.")
 args = parser.parse_args()
+if not args.manifest and not (args.params and args.folders):
+    parser.error("Parameters (-p) and folders are needed if no manifest is given.")
+if args.manifest or args.output:
+    # Headless: the plots are only saved, no windows are ever opened
+    matplotlib.use("Agg")
+import matplotlib.pyplot as plt
 
-# Loading the chains
-chains = [Chain(folder) for folder in args.folders]
+# Local imports
+sys.path.append("../src")
+from Chain import Chain
+from plot_lik import plot_lik_2D
 
-# Plotting
 try:
-    kwargs = json.loads(args.kwargs)
+    default_kwargs = json.loads(args.kwargs)
 except ValueError:
     raise ValueError("The dictionary after '-k'/'--keywords' could not be parsed!" +
                      " Check the input.")
-fig, axarr = plt.subplots(2,2)
-axes_locations = {                    "profile":  axarr[0,1],
-                  "mean": axarr[1,0], "marginal": axarr[1,1]}
-for mode, axes in axes_locations.items():
-    ax, options = plot_lik_2D(mode, chains, params=args.params, #format = "-loglik", dpi=200, fontsize_labels=14, fontsize_ticks=8,
-                save=0, axes=axes, **kwargs
-                )
-    axes.set_title(mode.title(), fontdict={'fontsize':16})
-
-# Text:
-text = ("Chain:\n %s\n\n"%[c.name() for c in chains] +
-        "Parameters:\n%s"%(args.params))
-axarr[0,0].set_axis_off()
-axarr[0,0].text(0, 1, text, weight="bold", verticalalignment="top")
-
-# Plot
-plt.tight_layout()
-if args.output:
-    plt.savefig(args.output[0], **options)
-else:
-    plt.show()
-plt.close()
+
+def plot_summary(chains, params, output=None, kwargs={}):
+    """
+    Plots the profile, mean and marginal likelihoods of the given chains
+    with respect to the given parameters, and saves the figure to 'output'
+    (or shows it, if not given).
+    """
+    fig, axarr = plt.subplots(2,2)
+    axes_locations = {                    "profile":  axarr[0,1],
+                      "mean": axarr[1,0], "marginal": axarr[1,1]}
+    for mode, axes in axes_locations.items():
+        ax, options = plot_lik_2D(mode, chains, params=params,
+                                  save=0, axes=axes, **kwargs)
+        axes.set_title(mode.title(), fontdict={'fontsize':16})
+    # Text:
+    text = ("Chain:\n %s\n\n"%[c.name() for c in chains] +
+            "Parameters:\n%s"%(params))
+    axarr[0,0].set_axis_off()
+    axarr[0,0].text(0, 1, text, weight="bold", verticalalignment="top")
+    # Plot
+    plt.tight_layout()
+    if output:
+        plt.savefig(output, **options)
+    else:
+        plt.show()
+    plt.close(fig)
+
+# Chains loaded by this process, shared by all the jobs it renders
+# (the least recently used ones are dropped beyond MAX_CHAINS)
+MAX_CHAINS = 8
+_chains = OrderedDict()
+
+def get_chain(folder):
+    if folder in _chains:
+        chain = _chains.pop(folder)
+    else:
+        chain = Chain(folder)
+    _chains[folder] = chain
+    while len(_chains) > MAX_CHAINS:
+        _chains.popitem(last=False)
+    return chain
+
+def render_job(job):
+    """
+    Renders a job of the manifest. Returns its output file, the time spent
+    loading chains and rendering, and the error message, if it failed.
+    """
+    start = loaded = time.time()
+    try:
+        chains = [get_chain(folder) for folder in job["folders"]]
+        loaded = time.time()
+        kwargs = dict(default_kwargs)
+        kwargs.update(job.get("keywords", {}))
+        plot_summary(chains, job["params"], job["output"], kwargs)
+        error = None
+    except Exception as e:
+        error = "%s: %s"%(type(e).__name__, e)
+        plt.close("all")
+    return job["output"], loaded - start, time.time() - loaded, error
+
+if __name__ == "__main__":
+    if not args.manifest:
+        chains = [Chain(folder) for folder in args.folders]
+        plot_summary(chains, args.params,
+                     args.output[0] if args.output else None, default_kwargs)
+        sys.exit(0)
+    with open(args.manifest, "r") as manifest:
+        jobs = json.load(manifest)
+    for job in jobs:
+        if not all(key in job for key in ["folders", "params", "output"]):
+            raise ValueError("Every job needs 'folders', 'params' and 'output': "
+                             "%s"%job)
+    # Jobs on the same chains are sent together, so that each worker loads
+    # every chain as few times as possible
+    jobs.sort(key=lambda job: sorted(job["folders"]))
+    n_workers = max(1, min(args.n_workers, len(jobs)))
+    chunksize = max(1, len(jobs) // (4*n_workers))
+    start = time.time()
+    failed = 0
+    pool = Pool(n_workers) if n_workers > 1 else None
+    try:
+        if pool:
+            results = pool.imap_unordered(render_job, jobs, chunksize)
+        else:
+            results = (render_job(job) for job in jobs)
+        # Reported as they finish
+        for output, t_load, t_plot, error in results:
+            print("%-40s load: %7.2f s   plot: %7.2f s   %s"%(
+                output, t_load, t_plot, "FAILED: " + error if error else "ok"))
+            sys.stdout.flush()
+            failed += bool(error)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    print("%d jobs (%d failed) in %.2f s with %d worker(s)"%(
+        len(jobs), failed, time.time() - start, n_workers))
+    sys.exit(1 if failed else 0)
@@ -1,6 +1,8 @@
 import os as os
 import numpy as np
 
+from table_reader import read_table
+
 T_CMB = 2.726
 
 class CMBspectrum():
@@ -87,14 +89,14 @@ class CMBspectrum():
         self._columns_indices = dict([a,i] for i,a in enumerate(self._columns))
         # 2.1. unlensed
         try:
-            data = np.loadtxt(cname)
+            data = read_table(cname)
         except IOError:
             raise IOError("The spectrum file does not exist: '%s'"%cname)
         self._uCl = np.transpose(data)
         # 2.2. lensed
         if self._lensed:
             try:
-                data = np.loadtxt(lname)
+                data = read_table(lname)
             except IOError:
                 raise IOError("The lensed spectrum file does not exist: '%s'"%cname)
             self._lCl = np.transpose(data)
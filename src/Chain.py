@@ -4,11 +4,306 @@
 ###################################################
 
 import os
+import json
+import hashlib
+from collections import OrderedDict
+from itertools import islice
+from multiprocessing import Pool
 import numpy as np
 import matplotlib.pyplot as plt
 import re
 
 from CLASS_tools import CMBspectrum_from_param_file_CLASS
+from table_reader import read_table, parse_table
+from chain_stats import WeightedMoments
+
+def _signature(chain, scaling):
+    """
+    Properties of a chain file (and its processing) that a cache must match.
+    """
+    stat = os.stat(chain)
+    return {"size": stat.st_size, "mtime": stat.st_mtime,
+            "scaling": list(scaling)}
+
+def _read_cache(cache_file, signature):
+    """
+    Returns the points stored in the given cache file (memory-mapped) and the
+    position in the chain file up to which they were read, if its signature
+    matches the given one, and (None, 0) otherwise.
+    """
+    try:
+        with open(cache_file + ".json", "r") as meta:
+            meta = json.load(meta)
+        offset = meta.pop("offset")
+        if meta == signature:
+            return np.load(cache_file, mmap_mode="r"), offset
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return None, 0
+
+def _read_chain_file(chain, n_columns, offset=0, complete_lines=False):
+    """
+    Returns the points of the given chain file (with 'n_columns' columns) from
+    the position 'offset', and the position right after the last line read.
+
+    If 'complete_lines' is True, a last line not terminated by a newline is
+    left for later, since it may be still being written (see 'Chain.refresh').
+    Otherwise, it is read too, unless it is incomplete.
+    """
+    points, end = read_table(chain, offset=offset, complete_lines=True)
+    if not points.size:
+        points = np.empty(shape=(0, n_columns))
+    if not complete_lines:
+        with open(chain, "rb") as cfile:
+            cfile.seek(end)
+            rest = cfile.read()
+        last = _parse_unterminated(rest, n_columns)
+        if last.shape[0]:
+            points = np.concatenate([points, last])
+            end += len(rest)
+    return points, end
+
+def _parse_unterminated(data, n_columns):
+    """
+    Points in 'data', the end of a chain file not terminated by a newline,
+    or none if it is not a complete line (e.g. one still being written).
+    """
+    try:
+        return parse_table(data, n_columns=n_columns)
+    except ValueError:
+        return np.empty(shape=(0, n_columns))
+
+def _load_chain_file(chain, scaling, cache_file=None):
+    """
+    Returns the points of the given chain file, multiplied column-wise by
+    'scaling'.
+
+    Also returns the position in the file right after the last line read:
+    a last line not terminated by a newline is only read if it is complete.
+
+    If 'cache_file' is given, the points are read from it (memory-mapped) if it
+    is up to date, or stored in it after being read from the chain file.
+    """
+    signature = _signature(chain, scaling)
+    if cache_file:
+        points, offset = _read_cache(cache_file, signature)
+        if points is not None:
+            return points, offset
+    points, offset = _read_chain_file(chain, len(scaling))
+    points *= scaling
+    if cache_file:
+        # Write to temporary files and rename, so that concurrent readers
+        # never find a half-written cache; failing to write it is harmless
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = "%s.%d.tmp"%(cache_file, os.getpid())
+            with open(tmp, "wb") as npy:
+                np.save(npy, points)
+            os.rename(tmp, cache_file)
+            with open(tmp, "w") as meta:
+                json.dump(dict(signature, offset=offset), meta)
+            os.rename(tmp, cache_file + ".json")
+        except (IOError, OSError):
+            pass
+    return points, offset
+
+def _iter_chain_file(chain, scaling, columns, block_size, cache_file=None):
+    """
+    Yields the points of the given chain file in blocks of at most
+    'block_size' rows, keeping only the given 'columns' (indices), scaled.
+
+    The cache file is used if it is up to date, but it is not created (that
+    would need all the points in memory at once). A last line not terminated
+    by a newline is only read if it is complete.
+    """
+    if cache_file:
+        points, _ = _read_cache(cache_file, _signature(chain, scaling))
+        if points is not None:
+            for start in range(0, points.shape[0], block_size):
+                yield points[start:start+block_size, columns]
+            return
+    n_columns = len(scaling)
+    scaling = scaling[columns]
+    with open(chain, "rb") as cfile:
+        while True:
+            lines = list(islice(cfile, block_size))
+            # Ignore a last line still being written
+            if (lines and not lines[-1].endswith(b"\n") and
+                    not _parse_unterminated(lines[-1], n_columns).shape[0]):
+                lines.pop()
+            if not lines:
+                break
+            block = parse_table(b"".join(lines))
+            if block.size:
+                yield block[:, columns] * scaling
+
+def _top_k(values, k):
+    """
+    Indices of the 'k' smallest values, sorted by value (ties by index).
+    """
+    if k < len(values):
+        # Every value tied with the k-th one is a candidate
+        threshold = values[np.argpartition(values, k-1)[k-1]]
+        indices = np.flatnonzero(values <= threshold)
+    else:
+        indices = np.arange(len(values))
+    return indices[np.lexsort((indices, values[indices]))][:k]
+
+def _parse_chain_file(job):
+    """
+    Worker of the parallel loading: returns the shape of the points of a chain
+    file, the position in the file right after the last line read, and the
+    points themselves, unless they could be stored in the given cache file
+    (if any), from which they are then read (memory-mapped) instead.
+    """
+    chain, scaling, cache_file = job
+    points, offset = _load_chain_file(chain, scaling, cache_file)
+    if cache_file:
+        cached, _ = _read_cache(cache_file, _signature(chain, scaling))
+        if cached is not None:
+            return points.shape, offset, None
+    return points.shape, offset, points
+
+def _row_count(rows):
+    """
+    Number of rows selected by 'rows': a slice with non-negative start and
+    stop and positive step, or an array of indices.
+    """
+    if isinstance(rows, slice):
+        return max(0, (rows.stop - rows.start + rows.step - 1) // rows.step)
+    return len(rows)
+
+def _select_rows(rows, selection):
+    """
+    Rows obtained by applying 'selection' (a slice, or an array of indices) to
+    'rows' (idem). If both are slices, so is the result, so that indexing the
+    points with it gives a view of them instead of a copy.
+    """
+    n = _row_count(rows)
+    if isinstance(selection, slice):
+        start, stop, step = selection.indices(n)
+        assert step > 0, "Only increasing selections are allowed."
+        if not isinstance(rows, slice):
+            return rows[start:stop:step]
+        count = max(0, (stop - start + step - 1) // step)
+        first = rows.start + start*rows.step
+        return slice(first, first + count*step*rows.step, step*rows.step)
+    selection = np.asarray(selection, dtype=int)
+    if isinstance(rows, slice):
+        return rows.start + selection*rows.step
+    return rows[selection]
+
+def _rows_key(rows):
+    """
+    Hashable description of some rows (see '_row_count').
+    """
+    if isinstance(rows, slice):
+        return (rows.start, rows.stop, rows.step)
+    return hashlib.md5(np.ascontiguousarray(rows, dtype=np.int64)).hexdigest()
+
+def _autocorrelation(values):
+    """
+    Normalised autocorrelation function of each column of 'values' (whose rows
+    are consecutive steps), as a function of the lag, computed with FFT's
+    (zero-padded, so that the correlation is not circular).
+    """
+    n = values.shape[0]
+    size = 2**int(np.ceil(np.log2(2*n)))
+    acf = np.empty(values.shape)
+    # Some columns at a time, to bound the memory used
+    n_columns = max(1, 2**24 // size)
+    for first in range(0, values.shape[1], n_columns):
+        columns = values[:, first:first+n_columns]
+        deviations = columns - columns.mean(axis=0)
+        power = np.abs(np.fft.rfft(deviations, n=size, axis=0))**2
+        acf[:, first:first+n_columns] = np.fft.irfft(power, n=size, axis=0)[:n]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return acf / acf[0]
+
+def _integrated_time(acf, window=5):
+    """
+    Integrated autocorrelation time of each column of the given normalised
+    autocorrelation functions, 1 + 2 sum_{t=1}^{M} acf(t), truncated at the
+    smallest lag M >= window * time(M) (Sokal's automatic window).
+    """
+    times = 2*np.cumsum(acf, axis=0) - 1
+    lags = np.arange(acf.shape[0])[:, np.newaxis]
+    beyond = lags >= window * times
+    cut = np.where(beyond.any(axis=0), beyond.argmax(axis=0), acf.shape[0] - 1)
+    return times[cut, np.arange(acf.shape[1])]
+
+# Statistics given by 'Chain.summary', and their MontePython-like names
+SUMMARY_STATS = [("r_minus_1", "R-1 values"), ("best_fit", "Best Fit"),
+                 ("mean", "mean"), ("std", "sigma"),
+                 ("minus_68", "1-sigma -"), ("plus_68", "1-sigma +"),
+                 ("minus_95", "2-sigma -"), ("plus_95", "2-sigma +"),
+                 ("lower_68", "1-sigma >"), ("upper_68", "1-sigma <"),
+                 ("lower_95", "2-sigma >"), ("upper_95", "2-sigma <")]
+
+def _summary_h_info(summary):
+    """
+    Horizontal table of a 'Chain.summary' (as MontePython's '.h_info').
+    """
+    params = list(summary.keys())
+    lines = [" param names\t:\t" + "".join(" %-15s"%p for p in params)]
+    for stat, name in SUMMARY_STATS:
+        fmt = " %f" if stat == "r_minus_1" else "% e"
+        lines.append(" %-10s\t:\t"%name +
+                     "\t".join(fmt%summary[p][stat] for p in params))
+    return "\n".join(lines) + "\n"
+
+def _summary_v_info(summary):
+    """
+    Vertical table of a 'Chain.summary' (as MontePython's '.v_info').
+    """
+    names = [name.replace(" values", "") for _, name in SUMMARY_STATS]
+    lines = ["%-15s\t: "%"param names" + " ".join("%-10s"%n for n in names)]
+    for param, stats in summary.items():
+        lines.append(" %-14s\t: "%param + " ".join(
+            ("%.4f" if stat == "r_minus_1" else "% .4e")%stats[stat]
+            for stat, _ in SUMMARY_STATS))
+    return "\n".join(lines) + "\n"
+
+def _summary_latex(summary, labels, min_mloglik):
+    """
+    LaTeX table of a 'Chain.summary' (as MontePython's '.tex').
+    """
+    lines = [r"\begin{tabular}{|l|c|c|c|c|} ", r" \hline ",
+             r"Param & best-fit & mean$\pm\sigma$ & 95\% lower & 95\% upper \\ \hline "]
+    for param, stats in summary.items():
+        label = labels.get(param, param)
+        if "$" not in label:
+            label = "$%s$"%label
+        lines.append(
+            r"%s &$%.4g$ & $%.4g_{%.2g}^{+%.2g}$ & $%.4g$ & $%.4g$ \\ "%(
+                label, stats["best_fit"], stats["mean"], stats["minus_68"],
+                stats["plus_68"], stats["lower_95"], stats["upper_95"]))
+    lines += [r"\hline ", r" \end{tabular} \\ ",
+              r"$-\ln{\cal L}_\mathrm{min} =%.6g$, minimum $\chi^2=%.2f$ \\ "%(
+                  min_mloglik, 2*min_mloglik)]
+    return "\n".join(lines) + "\n"
+
+def _interpolate_sorted(q, cumulative, values):
+    """
+    Weighted quantiles 'q' of the given sorted values, whose normalised
+    cumulative weights are 'cumulative': linear interpolation between the
+    middles of the weights of the points, found by bisection, i.e. O(log n).
+    """
+    q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    n = len(cumulative)
+    if n == 1:
+        return values[[0]*len(q)]
+    def centre(i):
+        before = np.where(i > 0, cumulative[np.maximum(i-1, 0)], 0.)
+        return (before + cumulative[i]) / 2.
+    k = np.minimum(np.searchsorted(cumulative, q), n-1)
+    left = np.clip(np.where(q < centre(k), k-1, k), 0, n-2)
+    c0, c1 = centre(left), centre(left+1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.nan_to_num(np.clip((q - c0) / (c1 - c0), 0, 1))
+    return values[left] + t * (values[left+1] - values[left])
 
 class Chain():
     """
@@ -33,51 +328,129 @@ class Chain():
     code: one of ["MontePython" (default), "CosmoMC", "CosmoMC+MultiNest", "CosmoMC+PolyChord"]
         Code with which the chain was generated (case insensitive).
 
+    cache: bool (default: True)
+        If True, the points of every chain file are stored in a binary '.npy'
+        file the first time they are loaded, and read from it (memory-mapped)
+        in subsequent loads, as long as the size and modification time of the
+        chain file have not changed. The points of a single chain file are
+        then used directly from the memory-mapped cache (read-only), and those
+        of several ones are put together only when all of them are needed.
+        The scaling factors of MontePython and the halving of the chi squared
+        of MultiNest/PolyChord are applied before storing the points.
+
+    cache_dir: str (default: None)
+        Folder in which the cache files are stored. By default, they are
+        stored as hidden files next to the chain files.
+
+    n_workers: int (default: 1)
+        Number of processes among which the parsing of the chain files is
+        distributed. The order of the points does not depend on it.
+
+    stream: bool (default: False)
+        If True, only the parameters of the chain are loaded at initialisation,
+        and the points are read from the files every time they are needed, in
+        blocks (see 'iter_blocks'), so that the memory used is bounded
+        independently of the length of the chain. The methods that need all
+        the points at once, e.g. 'points', are not available.
+
+    columns: list of parameter names (default: None)
+        If given, only these parameters (plus "#" and "mloglik") are loaded,
+        and the rest are ignored, e.g. by 'parameters()'.
+
+    dtype: numpy dtype (default: numpy.float64)
+        Type in which the points are stored. With 'numpy.float32' the memory
+        is halved, at the cost of precision (~1e-7 relative, also in the
+        'mloglik'). The cache files always store the full points in double
+        precision, so that they can be reused with any 'columns' and 'dtype'.
+
     """
-    def __init__(self, folder=None, prefix=None, code="MontePython"):
+    def __init__(self, folder=None, prefix=None, code="MontePython",
+                 cache=True, cache_dir=None, n_workers=1, stream=False,
+                 columns=None, dtype=np.float64):
         # Check input
         assert os.path.isdir(folder), \
             "The chain folder provided is not really a folder."
         self._folder = folder
         self._prefix = prefix
         self._code = code.lower()
+        self._cache = cache
+        self._cache_dir = cache_dir
+        self._stream = stream
+        # Weighted moments of the parameters (computed when needed)
+        self._moments = None
+        # Idem, for each chain file, for the convergence diagnostics
+        self._file_moments = None
+        # Autocorrelation of the parameters (computed when needed)
+        self._autocorr = None
+        # Sorted columns and their cumulative weights (computed when needed)
+        self._sorted_columns = {}
+        # In streaming mode: minima and maxima of the columns and best fits
+        # (computed when needed), and identity of the files from which all
+        # these were computed
+        self._extrema = None
+        self._stream_best_fits = {}
+        self._stats_identity = None
         # MontePython case
         if self._code == "montepython":
             self._load_params_montepython()
-            self._chains = [os.path.join(self._folder, a)
-                            for a in os.listdir(self._folder) if a[-4:]==".txt"]
         # CosmoMC case
-        elif self._code == "cosmomc":
-            self._load_params_cosmomc()
-            self._chains = [os.path.join(self._folder, a)
-                            for a in os.listdir(self._folder)
-                            if re.match(self._prefix+"_[0-9]+\.txt", a)] 
-        # CosmoMC+[MultiNest,PolyChord] case
-        elif self._code in ("cosmomc+multinest", "cosmomc+polychord"):
+        elif self._code in ("cosmomc", "cosmomc+multinest", "cosmomc+polychord"):
             self._load_params_cosmomc()
-            self._chains = [os.path.join(self._folder, a)
-                            for a in os.listdir(self._folder)
-                            if re.match(self._prefix+"\.txt", a)]
         else:
             raise ValueError("Code provided by keyword 'code' not known.")
+        # Parameters in the chain files, and those actually loaded
+        self._file_params = (self._sorted_varying_params +
+                             self._sorted_derived_params)
+        if columns is not None:
+            for param in columns:
+                if param not in self._file_params + ["#", "mloglik"]:
+                    raise ValueError("Unrecognized parameter: '%s'."%param)
+            self._sorted_varying_params = [
+                p for p in self._sorted_varying_params if p in columns]
+            self._sorted_derived_params = [
+                p for p in self._sorted_derived_params if p in columns]
+        self._build_param_index()
+        self._file_columns = [0, 1] + [2 + self._file_params.index(p)
+                                       for p in self.parameters()]
+        self._dtype = np.dtype(dtype)
+        self._chains = self._find_chain_files()
         # Points
-        individual_chains = []
-        for chain in self._chains:
-            # Handle empty files:
-            if os.path.getsize(chain) == 0:
-                continue
-            individual_chains.append(np.loadtxt(chain))
-        self._points = np.concatenate(individual_chains)
-        # Scaling -- MontePython
-        if self._code == "montepython":
-            for i, param in enumerate(self.varying_parameters() +
-                                      self.derived_parameters()):
-                self._points[:,i+2] *= float(self._raw_params["parameter"][param][4])
-        # LogLik better than ChiSq -- MultiNest
-        if self._code in ("cosmomc+multinest", "cosmomc+polychord"):
-            self._points[:,1] /= 2
-        # Finding best fit(s) -- faster if done now (only once!)
-        self._mloglik_sorted_points = sorted(self._points, key=lambda x: x[1])
+        if self._stream:
+            return
+        # Handle empty files:
+        non_empty = [chain for chain in self._chains
+                     if os.path.getsize(chain) > 0]
+        # Position up to which each file has been read (see 'refresh')
+        self._offsets = dict((chain, 0) for chain in self._chains)
+        # Rows of the points coming from each file: [file, start, stop]
+        # (a file can have several segments, if it has been refreshed)
+        self._segments = []
+        if n_workers > 1 and len(non_empty) > 1:
+            self._points = self._load_chain_files_parallel(
+                non_empty, min(n_workers, len(non_empty)))
+        else:
+            pieces = []
+            for chain in non_empty:
+                points, self._offsets[chain] = self._load_chain_file(chain)
+                if points.shape[0]:
+                    self._add_segment(chain, points.shape[0])
+                    pieces.append(self._compact(points))
+            if len(pieces) > 1:
+                # Put together the first time they are needed: see '__getattr__'
+                self._pieces = pieces
+            elif pieces:
+                # Not copied, i.e. still memory-mapped if read from the cache
+                self._points = pieces[0]
+            else:
+                self._points = np.empty(shape=(0, len(self._file_columns)),
+                                        dtype=self._dtype)
+        # Indices of the best fit points, sorted (computed when needed)
+        self._best_fit_index = None
+    def __getattr__(self, attr):
+        if attr == "_points" and "_pieces" in self.__dict__:
+            self._points = np.concatenate(self.__dict__.pop("_pieces"))
+            return self._points
+        raise AttributeError(attr)
 
     # Load parameters
     def _load_params_montepython(self):
@@ -162,6 +535,211 @@ class Chain():
                 self._param_labels[param] = r"%s"%line.split()[1].strip()
 
 
+    # Load points
+    def _find_chain_files(self):
+        """
+        Returns the (sorted) list of chain files in the folder.
+        """
+        if self._code == "montepython":
+            chains = [os.path.join(self._folder, a)
+                      for a in os.listdir(self._folder) if a[-4:]==".txt"]
+        elif self._code == "cosmomc":
+            chains = [os.path.join(self._folder, a)
+                      for a in os.listdir(self._folder)
+                      if re.match(self._prefix+"_[0-9]+\.txt", a)]
+        elif self._code in ("cosmomc+multinest", "cosmomc+polychord"):
+            chains = [os.path.join(self._folder, a)
+                      for a in os.listdir(self._folder)
+                      if re.match(self._prefix+"\.txt", a)]
+        return sorted(chains)
+    def _scaling(self):
+        """
+        Factors by which each column of the chain files must be multiplied:
+        the MontePython scaling factors of the parameters, and 1/2 for the
+        chi squared of MultiNest and PolyChord (loglik better than chisq).
+        """
+        scaling = np.ones(2 + len(self._file_params))
+        if self._code == "montepython":
+            for i, param in enumerate(self._file_params):
+                scaling[i+2] = float(self._raw_params["parameter"][param][4])
+        if self._code in ("cosmomc+multinest", "cosmomc+polychord"):
+            scaling[1] = 0.5
+        return scaling
+    def _compact(self, points):
+        """
+        Keeps only the loaded columns of the given (full) points, and converts
+        them to the storage type.
+        """
+        if len(self._file_columns) < points.shape[1]:
+            points = points[:, self._file_columns]
+        return np.asarray(points, dtype=self._dtype)
+    def _cache_file(self, chain):
+        """
+        Name of the cache file of the given chain file.
+        """
+        if not self._cache_dir:
+            return os.path.join(os.path.dirname(chain),
+                                "." + os.path.basename(chain) + ".npy")
+        # In a common folder, the chain names alone may collide
+        path_hash = hashlib.md5(
+            os.path.abspath(chain).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self._cache_dir, "%s_%s.npy"%(
+            os.path.basename(chain), path_hash))
+    def _load_chain_file(self, chain):
+        """
+        Returns the (scaled) points of the given chain file, using the cache
+        if it exists and it is up to date, and creating it otherwise, and the
+        position in the file up to which it has been read.
+        """
+        return _load_chain_file(
+            chain, self._scaling(),
+            self._cache_file(chain) if self._cache else None)
+    def _load_chain_files_parallel(self, chains, n_workers):
+        """
+        Parses the given chain files in a pool of 'n_workers' processes, and
+        puts their points, in order, into a single preallocated array.
+
+        If the cache is enabled, the workers hand the points over through the
+        cache files, so that they are not pickled. Otherwise, or if a cache
+        file could not be written (e.g. read-only folder), they return the
+        parsed points.
+        """
+        jobs = [(chain, self._scaling(),
+                 self._cache_file(chain) if self._cache else None)
+                for chain in chains]
+        pool = Pool(n_workers)
+        try:
+            results = pool.map(_parse_chain_file, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        points = np.empty(shape=(sum(shape[0] for shape, _, _ in results),
+                                 len(self._file_columns)),
+                          dtype=self._dtype)
+        row = 0
+        for (chain, scaling, cache_file), (shape, offset, piece) in zip(
+                jobs, results):
+            if piece is None:
+                try:
+                    piece = np.load(cache_file, mmap_mode="r")
+                # Removed since the worker wrote it: the rows read by the
+                # worker are the first ones of the file, even if it has grown
+                except (IOError, OSError):
+                    piece = _read_chain_file(chain, len(scaling))[0] * scaling
+                piece = piece[:shape[0]]
+            points[row:row+shape[0]] = self._compact(piece)
+            self._offsets[chain] = offset
+            self._add_segment(chain, shape[0])
+            row += shape[0]
+        return points
+
+    # Follow running chains
+    def refresh(self):
+        """
+        Reads the points appended to the chain files (and those of new chain
+        files) since they were last read, so that a running chain can be
+        monitored without reading it again from the beginning.
+
+        A last line still being written is left for the next call.
+
+        Returns the number of new points.
+        """
+        if self._stream:
+            # Nothing to update: the files are read every time, but what was
+            # computed from them may be out of date
+            self._check_stream_files()
+            return 0
+        self._chains = self._find_chain_files()
+        n_old = self._segments[-1][2] if self._segments else 0
+        n_segments = len(self._segments)
+        new_points = []
+        for chain in self._chains:
+            offset = self._offsets.get(chain, 0)
+            if os.path.getsize(chain) <= offset:
+                continue
+            points, self._offsets[chain] = _read_chain_file(
+                chain, len(self._scaling()), offset, complete_lines=True)
+            if points.size:
+                self._add_segment(chain, points.shape[0])
+                new_points.append(self._compact(points * self._scaling()))
+        if not new_points:
+            return 0
+        new_points = np.concatenate(new_points)
+        self._append_points(new_points)
+        # Update the moments with the new points
+        if self._moments is not None:
+            self._moments.update(new_points[:, 0], new_points[:, 2:])
+        if self._file_moments is not None:
+            self._add_file_moments(self._segments[n_segments:])
+        # Update the best fits with the best new ones
+        if self._best_fit_index is not None:
+            how_many = len(self._best_fit_index)
+            candidates = np.concatenate([
+                self._best_fit_index,
+                n_old + _top_k(new_points[:, 1], how_many)])
+            self._best_fit_index = candidates[
+                _top_k(self._points[candidates, 1], how_many)]
+        return new_points.shape[0]
+    def _append_points(self, new_points):
+        """
+        Appends the given points, growing the buffer geometrically, so that the
+        cost is proportional to the number of new points.
+        """
+        n_old = self._points.shape[0]
+        n_new = n_old + new_points.shape[0]
+        # The points are a view of a bigger buffer (once something is appended:
+        # the points loaded at first may be a read-only memory map)
+        buffer = self.__dict__.get("_buffer", self._points)
+        if n_new > buffer.shape[0]:
+            self._buffer = np.empty(shape=(n_new + n_new//2, buffer.shape[1]),
+                                    dtype=buffer.dtype)
+            self._buffer[:n_old] = self._points
+        self._buffer[n_old:n_new] = new_points
+        self._points = self._buffer[:n_new]
+        self._reset_cached_stats()
+    def _add_segment(self, chain, n_points):
+        """
+        Records that the next 'n_points' rows come from the file 'chain'.
+        """
+        start = self._segments[-1][2] if self._segments else 0
+        if n_points:
+            self._segments.append([chain, start, start + n_points])
+    def _reset_cached_stats(self):
+        """
+        Forgets the quantities computed from the points, after they change.
+        """
+        self._autocorr = None
+        self._sorted_columns = {}
+    def _check_stream_files(self):
+        """
+        In streaming mode, looks for new chain files, and forgets the
+        quantities computed from the points if the files have changed since.
+        """
+        if not self._stream:
+            return
+        self._chains = self._find_chain_files()
+        identity = self.identity()
+        if identity != self._stats_identity:
+            self._moments = None
+            self._file_moments = None
+            self._extrema = None
+            self._stream_best_fits = {}
+            self._reset_cached_stats()
+            self._stats_identity = identity
+
+    def _build_param_index(self):
+        """
+        Name-to-index mappings of the (loaded) parameters, for fast lookups:
+        '_param_index' within the list of parameters, and '_column_index'
+        within a chain point row.
+        """
+        self._parameters = (self._sorted_varying_params +
+                            self._sorted_derived_params)
+        self._param_index = dict((p, i) for i, p in enumerate(self._parameters))
+        self._column_index = dict((p, i+2) for p, i in self._param_index.items())
+        self._column_index["#"] = 0
+        self._column_index["mloglik"] = 1
+
     # Get chain data in a code independent way
     def name(self):
         return self._name
@@ -170,7 +748,7 @@ class Chain():
     def derived_parameters(self):
         return self._sorted_derived_params
     def parameters(self):
-        return self.varying_parameters()+self.derived_parameters()
+        return self._parameters
     def parameter_label(self, param):
         return self._param_labels[param]
     def set_parameter_labels(self, labels):
@@ -185,12 +763,29 @@ class Chain():
         """
         params = []
         for param, label in labels.items():
-            if param in self.parameters():
+            if param in self._param_index:
                 self._param_labels[param] = label
                 params.append(param)
         return params
     def chain_files(self):
         return self._chains
+    def identity(self):
+        """
+        Hashable description of the points of the chain, for caching results
+        computed from them: the chain files, their modification times and the
+        number of bytes read from them, and the processing of the columns.
+
+        It changes whenever the points may have changed (e.g. after a
+        'refresh', or if a file is modified).
+        """
+        files = []
+        for chain in self._chains:
+            stat = os.stat(chain)
+            read = stat.st_size if self._stream else self._offsets.get(chain, 0)
+            files.append((os.path.abspath(chain), stat.st_mtime, read))
+        return (self._code, tuple(files),
+                tuple(float(s) for s in self._scaling()),
+                tuple(self._file_columns), self._dtype.str)
     def index_of_param(self, param, chain=False):
         """
         Returns the index of the given parameter.
@@ -198,18 +793,30 @@ class Chain():
         If the keyword 'chain' is set to True (default: False) gives the index
         within a chain point row.
         """
-        offset = 2 if chain else 0
-        if param == "#" and chain:
-            return 0
-        elif param == "mloglik" and chain:
-            return 1
-        elif param in self.varying_parameters():
-            return offset + self.varying_parameters().index(param)
-        elif param in self.derived_parameters():
-            return (offset + len(self.varying_parameters()) +
-                    self.derived_parameters().index(param))
-        else:
+        try:
+            if chain:
+                return self._column_index[param]
+            else:
+                return self._param_index[param]
+        except KeyError:
             raise ValueError("Unrecognized parameter: '"+str(param)+"'.")
+    def has_param(self, param):
+        """
+        Returns True if the given parameter is in the chain (and loaded).
+        """
+        return param in self._param_index
+    def columns(self, params=None):
+        """
+        Returns a dictionary of the columns of the given parameters (default:
+        all, including "#" and "mloglik"), indexed by name.
+
+        The columns are views of the chain points, i.e. no data is copied.
+        """
+        if params is None:
+            params = ["#", "mloglik"] + self.parameters()
+        points = self.points()
+        return dict((p, points[:, self.index_of_param(p, chain=True)])
+                    for p in params)
     def points(self, param=None):
         """
         Possibilities:
@@ -220,20 +827,95 @@ class Chain():
         * param == <param_name> : chain points for said parameter
 
         """
+        if self._stream:
+            raise ValueError("The points are not kept in memory in streaming "
+                             "mode: use 'iter_blocks' instead.")
         if not param:
             return self._points
+        column = self.index_of_param(param, chain=True)
+        if "_pieces" in self.__dict__:
+            # Only this column is put together
+            return np.concatenate([piece[:, column] for piece in self._pieces])
+        return self._points[:, column]
+    def iter_blocks(self, params=None, block_size=100000, files=None):
+        """
+        Iterates over the chain points in blocks (2D arrays) of at most
+        'block_size' rows.
+
+        If a list of parameters 'params' is given (including possibly "#" and
+        "mloglik"), the columns of the blocks are those parameters, in the
+        given order. Otherwise, they are full chain points.
+
+        If a list of chain files 'files' is given, only their points are used.
+
+        In streaming mode, only the requested columns are kept in memory.
+        """
+        if params is None:
+            columns = list(range(2 + len(self.parameters())))
         else:
-            return self._points[:, self.index_of_param(param, chain=True)]
+            columns = [self.index_of_param(p, chain=True) for p in params]
+        if not self._stream:
+            if "_pieces" in self.__dict__:
+                # Not put together yet: read from the points of each file
+                ranges = [(piece, 0, piece.shape[0]) for piece, (chain, _, _)
+                          in zip(self._pieces, self._segments)
+                          if files is None or chain in files]
+            elif files is None:
+                ranges = [(self._points, 0, self._points.shape[0])]
+            else:
+                ranges = [(self._points, start, stop)
+                          for chain, start, stop in self._segments
+                          if chain in files]
+            for points, first, last in ranges:
+                for start in range(first, last, block_size):
+                    block = points[start:min(start+block_size, last)]
+                    yield block if params is None else block[:, columns]
+            return
+        for chain in self._chains:
+            if os.path.getsize(chain) == 0:
+                continue
+            if files is not None and chain not in files:
+                continue
+            for block in _iter_chain_file(
+                    chain, self._scaling(),
+                    [self._file_columns[i] for i in columns], block_size,
+                    self._cache_file(chain) if self._cache else None):
+                yield np.asarray(block, dtype=self._dtype)
     def get_min(self, param):
         """
         Gets the minimum value of the given parameter that the chain has reached.
         """
+        if self._stream:
+            return self._stream_extrema()[0][self.index_of_param(param,
+                                                                 chain=True)]
         return self.points(param=param).min()
     def get_max(self, param):
         """
         Gets the maximum value of the given parameter that the chain has reached.
         """
+        if self._stream:
+            return self._stream_extrema()[1][self.index_of_param(param,
+                                                                 chain=True)]
         return self.points(param=param).max()
+    def _stream_extrema(self):
+        """
+        Minima and maxima of all the columns, computed together in a single
+        pass over the files, and kept until they change.
+        """
+        self._check_stream_files()
+        if self._extrema is None:
+            n_columns = 2 + len(self.parameters())
+            minima = np.empty(n_columns)
+            minima.fill(np.inf)
+            maxima = -minima
+            for block in self.iter_blocks():
+                if block.shape[0]:
+                    np.minimum(minima, block.min(axis=0), out=minima)
+                    np.maximum(maxima, block.max(axis=0), out=maxima)
+            if np.isinf(minima[0]):
+                raise ValueError("The chain has no points.")
+            self._extrema = (minima, maxima)
+        return self._extrema
     def get_limits(self, param):
         """
         Gets the limits *imposed* on the search for the given parameter
@@ -256,59 +938,262 @@ class Chain():
                              "it is a derived parameter.")
         else:
             raise ValueError("The parameter '%s' is not recognised."%param)
-    def best_fit(self, how_many=1, param=None):
+    def best_fit(self, how_many=1, param=None, params=None, per_file=False):
         """
         Returns the best fit point(s) of the chain, as many as the value of
-        'how_many'.
+        'how_many', as rows of an array, sorted from best to worst.
 
-        A parameter can be specified to get only its best fit value.
+        A parameter can be specified to get only its best fit value(s), or a
+        list of them with 'params' to get only those columns (in that order).
+
+        If 'per_file' is True, returns a dictionary whose keys are the chain
+        files and the values their respective best fit point(s).
         """
-        points = self._mloglik_sorted_points[:how_many]
         if param:
-            return [p[self._index_of_param(param, chain=True)] for p in points]
+            params = [param]
+        if params:
+            columns = [self.index_of_param(p, chain=True) for p in params]
+        else:
+            columns = slice(None)
+        if per_file:
+            best = {}
+            for chain in self._chains:
+                if self._stream:
+                    points = self._best_fit_streaming(how_many, params, chain)
+                    if points.shape[0]:
+                        best[chain] = points
+                    continue
+                rows = self._rows_of_file(chain)
+                if len(rows):
+                    index = rows[_top_k(self._points[rows, 1], how_many)]
+                    best[chain] = self._points[index][:, columns]
+        elif self._stream:
+            best = self._best_fit_streaming(how_many, params)
         else:
-            return points
+            if (self._best_fit_index is None or
+                len(self._best_fit_index) < min(how_many, len(self._points))):
+                self._best_fit_index = _top_k(self._points[:, 1], how_many)
+            best = self._points[self._best_fit_index[:how_many]][:, columns]
+        if param:
+            if per_file:
+                return dict((chain, b[:, 0]) for chain, b in best.items())
+            return best[:, 0]
+        return best
+    def _best_fit_streaming(self, how_many, params=None, chain=None):
+        """
+        Best fit points (of the given chain file, if any), reading only the
+        'mloglik' and the given parameters, and keeping only the best
+        'how_many' ones of each block.
+
+        They are kept until the files change.
+        """
+        self._check_stream_files()
+        if not params:
+            params = ["#", "mloglik"] + self.parameters()
+        key = (tuple(params), chain)
+        if key in self._stream_best_fits:
+            kept, best = self._stream_best_fits[key]
+            if how_many <= kept:
+                return best[:how_many].copy()
+        read = list(params)
+        if "mloglik" not in read:
+            read.append("mloglik")
+        best = np.empty(shape=(0, len(read)), dtype=self._dtype)
+        for block in self.iter_blocks(read,
+                                      files=None if chain is None else [chain]):
+            block = np.concatenate([best, block])
+            best = block[_top_k(block[:, read.index("mloglik")], how_many)]
+        best = best[:, :len(params)]
+        self._stream_best_fits[key] = (how_many, best)
+        return best.copy()
+    def _rows_of_file(self, chain):
+        """
+        Indices of the rows of the points coming from the given chain file.
+        """
+        rows = [np.arange(start, stop)
+                for c, start, stop in self._segments if c == chain]
+        if not rows:
+            return np.arange(0)
+        return np.concatenate(rows)
+
+    # Views: merging, burn-in, thinning and filtering
+    def _view_parts(self):
+        """
+        The points of the chain, as a list of (chain, file, rows): the rows
+        of the points of 'chain' coming from the chain file 'file'.
+        """
+        if self._stream:
+            raise ValueError("Views need the points in memory: "
+                             "they are not available in streaming mode.")
+        return [(self, chain, slice(start, stop, 1))
+                for chain, start, stop in self._segments]
+    @staticmethod
+    def merge(chains):
+        """
+        Returns a 'ChainView' presenting the points of all the given chains
+        (with the same parameters) as a single chain, without copying them.
+        """
+        parts = []
+        for chain in chains:
+            parts += chain._view_parts()
+        return ChainView(parts, name="+".join(chain.name() for chain in chains))
+    def burn_in(self, n):
+        """
+        Returns a 'ChainView' without the first 'n' points of each chain file,
+        or, if 'n' is a float smaller than 1, without that fraction of them.
+        """
+        parts = self._view_parts()
+        totals = {}
+        for base, chain, rows in parts:
+            key = (id(base), chain)
+            totals[key] = totals.get(key, 0) + _row_count(rows)
+        # Points still to be removed from each file
+        if isinstance(n, float) and n < 1:
+            to_skip = dict((key, int(n*total)) for key, total in totals.items())
+        else:
+            to_skip = dict((key, int(n)) for key in totals)
+        new_parts = []
+        for base, chain, rows in parts:
+            key = (id(base), chain)
+            skip = min(to_skip[key], _row_count(rows))
+            to_skip[key] -= skip
+            new_parts.append((base, chain, _select_rows(rows, slice(skip, None))))
+        return ChainView(new_parts, name=self.name())
+    def thin(self, step=None, auto=False):
+        """
+        Returns a 'ChainView' with one in every 'step' points of the chain
+        (regardless of their weights '#').
+
+        If 'auto' is True, the step is chosen so that the points are roughly
+        independent: the largest integrated autocorrelation time of the
+        varying parameters (see 'autocorrelation_time'), in points.
+        """
+        if auto:
+            assert step is None, "Give either a 'step' or 'auto=True'."
+            _, n_steps, n_rows = self._assert_calculated_autocorr()
+            times = [self.autocorrelation_time(p)
+                     for p in self.varying_parameters()]
+            step = max(1, int(np.ceil(np.nanmax(times) * n_rows / n_steps)))
+        assert step is not None, "Give either a 'step' or 'auto=True'."
+        step = int(step)
+        assert step >= 1, "The thinning step must be a positive integer."
+        new_parts = []
+        position = 0
+        for base, chain, rows in self._view_parts():
+            new_parts.append((base, chain, _select_rows(
+                rows, slice((-position) % step, None, step))))
+            position += _row_count(rows)
+        return ChainView(new_parts, name=self.name())
+    def filter(self, mask):
+        """
+        Returns a 'ChainView' with only the points for which the boolean array
+        'mask' (one value per point, e.g. 'chain.points("H0") > 68') is True.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        n_points = sum(_row_count(rows) for _, _, rows in self._view_parts())
+        if mask.shape != (n_points,):
+            raise ValueError("The mask must have one value per point (%d)."
+                             %n_points)
+        return self._take(np.flatnonzero(mask))
+    def select(self, **ranges):
+        """
+        Returns a 'ChainView' with the points whose parameters are within the
+        given ranges (bounds included, None for no bound), e.g.
+        'chain.select(H0=[66, 70], omega_b=[0.022, None])'.
 
-    # Covariance matrix 
+        The points in the range of each parameter are found by bisection in
+        its sorted column (kept, see 'quantile'), and only those of the most
+        selective parameter are checked against the rest, so that the cost of
+        a selection is sub-linear in the number of points of the chain (after
+        the first one on each parameter, which sorts its column).
+        """
+        candidates = []
+        for param, (lower, upper) in ranges.items():
+            values, _, order = self._sorted_column(param)
+            first = (0 if lower is None else
+                     np.searchsorted(values, lower, side="left"))
+            last = (len(values) if upper is None else
+                    np.searchsorted(values, upper, side="right"))
+            candidates.append((last - first, param, lower, upper,
+                               order[first:last]))
+        if not candidates:
+            return ChainView(self._view_parts(), name=self.name())
+        candidates.sort(key=lambda candidate: candidate[0])
+        rows = np.sort(candidates[0][4])
+        for _, param, lower, upper, _ in candidates[1:]:
+            values = self._values_at(param, rows)
+            inside = np.ones(len(rows), dtype=bool)
+            if lower is not None:
+                inside &= values >= lower
+            if upper is not None:
+                inside &= values <= upper
+            rows = rows[inside]
+        return self._take(rows)
+    def _take(self, rows):
+        """
+        Returns a 'ChainView' with the points of the given (sorted) rows.
+        """
+        parts = self._view_parts()
+        starts = np.cumsum([0] + [_row_count(r) for _, _, r in parts])
+        bounds = np.searchsorted(rows, starts)
+        return ChainView(
+            [(base, chain, _select_rows(r, rows[bounds[k]:bounds[k+1]] - starts[k]))
+             for k, (base, chain, r) in enumerate(parts)], name=self.name())
+    def _values_at(self, param, rows):
+        """
+        Values of 'param' at the given (sorted) rows.
+        """
+        return self.points()[rows, self.index_of_param(param, chain=True)]
+
+    # Means, covariance matrix and correlations
     def _calculate_covariance_matrix(self):
         """
         You shouldn't need to call this function, though you may want to test
         different calculation methods.
-        """
-        # total_steps = np.sum(self.points("#"))
-        # weights = self.points("#")/total_steps
-        # means = [np.sum(weights*self.points(p)) for p in
-        #          self.varying_params()+self.derived_params()]
-        # print means
 
-        # For now, just read it from the .covmat file
-        if self._code == "montepython":
-            print ("TODO: at this point, the covmat is read from the file " +
-                   "generated by MontePython's analysis routine, " +
-                   "instead of calculated here!.")
-            try:
-                covmat = np.loadtxt(os.path.join(self._folder,
-                                                 self._name + ".covmat"))
-            except IOError:
-                raise IOError("The '.covmat' file was not found. "+
-                              "Maybe because the chain has never been analysed.")
-            self._covmat = covmat
-        else:
-            raise NotImplementedError("Not implemented for '%s'"%self._code)
+        Computes the weighted means and covariance matrix of all the parameters
+        in a single pass over the points, block by block (so that it works in
+        streaming mode too).
+        """
+        moments = WeightedMoments(len(self.parameters()))
+        for block in self.iter_blocks():
+            moments.update(block[:, 0], block[:, 2:])
+        self._moments = moments
     def _assert_calculated_covmat(self):
-        if not hasattr(self, "_covmat"):
+        self._check_stream_files()
+        if self._moments is None:
             self._calculate_covariance_matrix()
+    def moments(self, params=None):
+        """
+        Returns the 'WeightedMoments' of the given parameters (default: all),
+        e.g. to merge them with those of other chains.
+        """
+        self._assert_calculated_covmat()
+        if params is None:
+            params = self.parameters()
+        return self._moments.select([self.index_of_param(p) for p in params])
+    def mean(self, param=None):
+        """
+        Returns the (weighted) mean of 'param',
+        or those of all the parameters if called without arguments.
+        """
+        self._assert_calculated_covmat()
+        means = self._moments.mean()
+        if param:
+            return means[self.index_of_param(param)]
+        return means
     def covariance(self, param1=None, param2=None):
         """
         Returns the covariance between 'param1' and 'param2',
         or the full covariance matrix if called without arguments.
         """
         self._assert_calculated_covmat()
+        covmat = self._moments.covariance()
         if param1 and param2:
-            return self._covmat[self.index_of_param(param1, chain=False),
-                                self.index_of_param(param2, chain=False)]
+            return covmat[self.index_of_param(param1, chain=False),
+                          self.index_of_param(param2, chain=False)]
         else:
-            return self._covmat
+            return covmat
     def variance(self, param):
         """
         Returns the variance of 'param'.
@@ -324,13 +1209,289 @@ class Chain():
             return (self.covariance(param1, param2) /
                     np.sqrt(self.variance(param1)*self.variance(param2)))
         else:
-            corrmat = np.ones(shape=self._covmat.shape)
-            for param1 in self.parameters():
-                for param2 in self.parameters():
-                    corrmat[self.index_of_param(param1),
-                            self.index_of_param(param2)] = \
-                        self.correlation(param1, param2)
-            return corrmat
+            return self._moments.correlation()
+
+    # Convergence diagnostics
+    def convergence(self, param=None):
+        """
+        Returns the Gelman-Rubin R-1 of 'param', or those of all the parameters
+        if called without arguments, comparing the points of the different
+        chain files: the ratio of the variance of their means to the mean of
+        their variances, weighted by the sum of the weights '#' of each file:
+
+            R-1 = [M/(M-1) sum_j W_j (mean_j - mean)^2] / [sum_j W_j var_j]
+
+        being 'M' the number of files with points, 'W_j' their total weights,
+        and 'mean' the mean of all the points.
+
+        The moments of each file are computed in a single vectorised pass, and
+        updated with the new points after a 'refresh', so that the convergence
+        of a running chain can be checked cheaply every now and then.
+        """
+        self._check_stream_files()
+        if self._file_moments is None:
+            self._file_moments = OrderedDict()
+            if self._stream:
+                for chain in self._chains:
+                    moments = WeightedMoments(len(self.parameters()))
+                    for block in self.iter_blocks(files=[chain]):
+                        moments.update(block[:, 0], block[:, 2:])
+                    if moments.weight() > 0:
+                        self._file_moments[chain] = [
+                            moments.weight(), moments.mean(),
+                            np.diag(moments.covariance()) * moments.weight()]
+            else:
+                self._add_file_moments(self._segments)
+        stats = [m for m in self._file_moments.values() if m[0] > 0]
+        if len(stats) < 2:
+            raise ValueError("The convergence needs at least 2 chain files "
+                             "with points.")
+        weights = np.array([m[0] for m in stats])
+        means = np.array([m[1] for m in stats])
+        sq_devs = np.array([m[2] for m in stats])
+        mean = weights.dot(means) / weights.sum()
+        between = (len(stats) / (len(stats) - 1.) *
+                   weights.dot((means - mean)**2))
+        within = sq_devs.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_minus_1 = between / within
+        if param:
+            return r_minus_1[self.index_of_param(param)]
+        return r_minus_1
+    def _add_file_moments(self, segments):
+        """
+        Adds to the moments of each file those of the points in the given
+        (consecutive) segments of rows [file, start, stop]: the sum of their
+        weights, their weighted means, and their weighted sums of squared
+        deviations from the mean, computed at once for all the segments.
+        """
+        if not segments:
+            return
+        first, last = segments[0][1], segments[-1][2]
+        block = self.points()[first:last]
+        bounds = np.array([start for _, start, _ in segments]) - first
+        counts = np.diff(np.append(bounds, last - first))
+        weights = np.asarray(block[:, 0], dtype=np.float64)
+        values = np.asarray(block[:, 2:], dtype=np.float64)
+        sums = np.add.reduceat(weights, bounds)
+        filled = sums > 0
+        means = np.add.reduceat(weights[:, np.newaxis] * values, bounds)
+        means[filled] /= sums[filled, np.newaxis]
+        deviations = values - np.repeat(means, counts, axis=0)
+        sq_devs = np.add.reduceat(weights[:, np.newaxis] * deviations**2, bounds)
+        # Merge with the previous points of the same file (Chan et al.)
+        for (chain, _, _), weight, mean, sq_dev in zip(
+                segments, sums, means, sq_devs):
+            if chain not in self._file_moments:
+                self._file_moments[chain] = [weight, mean, sq_dev]
+                continue
+            old_weight, old_mean, old_sq_dev = self._file_moments[chain]
+            total = old_weight + weight
+            if total == 0:
+                continue
+            delta = mean - old_mean
+            self._file_moments[chain] = [
+                total, old_mean + delta * weight / total,
+                old_sq_dev + sq_dev + delta**2 * old_weight * weight / total]
+
+
+    # Autocorrelation and effective sample size
+    def _calculate_autocorrelation(self):
+        """
+        Computes the autocorrelation functions of all the parameters, with
+        FFT's, for each chain file, and averages them over the files,
+        weighted by their number of steps.
+
+        If the weights '#' are integers (the number of steps the sampler stayed
+        at each point, e.g. MontePython), the lags are counted in steps, i.e.
+        each point is repeated as many times as its weight. Otherwise, each
+        point is a step.
+        """
+        acfs = []
+        n_steps = 0
+        n_rows = 0
+        for chain in self._chains:
+            blocks = list(self.iter_blocks(files=[chain]))
+            if not blocks:
+                continue
+            points = np.concatenate(blocks)
+            weights = points[:, 0]
+            values = np.asarray(points[:, 2:], dtype=np.float64)
+            if weights.min() >= 0 and np.all(weights == np.round(weights)):
+                values = np.repeat(values, weights.astype(int), axis=0)
+            if values.shape[0] < 2:
+                continue
+            acfs.append(_autocorrelation(values))
+            n_steps += values.shape[0]
+            n_rows += points.shape[0]
+        if not acfs:
+            raise ValueError("The autocorrelation needs chain files with at "
+                             "least 2 steps.")
+        # Average, at each lag, over the files long enough to have it
+        max_lag = max(acf.shape[0] for acf in acfs)
+        total = np.zeros((max_lag, len(self.parameters())))
+        norm = np.zeros((max_lag, 1))
+        for acf in acfs:
+            total[:acf.shape[0]] += acf.shape[0] * acf
+            norm[:acf.shape[0]] += acf.shape[0]
+        self._autocorr = (total / norm, n_steps, n_rows)
+    def _assert_calculated_autocorr(self):
+        self._check_stream_files()
+        if self._autocorr is None:
+            self._calculate_autocorrelation()
+        return self._autocorr
+    def autocorrelation(self, param=None):
+        """
+        Returns the normalised autocorrelation function of 'param' as a
+        function of the lag (in steps, see '_calculate_autocorrelation'),
+        or those of all the parameters (as columns) if called without arguments.
+        """
+        acf = self._assert_calculated_autocorr()[0]
+        if param:
+            return acf[:, self.index_of_param(param)]
+        return acf
+    def autocorrelation_time(self, param=None):
+        """
+        Returns the integrated autocorrelation time (in steps) of 'param',
+        or those of all the parameters if called without arguments.
+        """
+        times = _integrated_time(self._assert_calculated_autocorr()[0])
+        if param:
+            return times[self.index_of_param(param)]
+        return times
+    def effective_sample_size(self, param=None):
+        """
+        Returns the effective number of independent samples of 'param' (the
+        number of steps over the integrated autocorrelation time), or those of
+        all the parameters if called without arguments.
+        """
+        n_steps = self._assert_calculated_autocorr()[1]
+        return n_steps / self.autocorrelation_time(param)
+
+    # Quantiles and credible intervals
+    def _sorted_column(self, param):
+        """
+        Returns the values of 'param' sorted, the cumulative weights of the
+        sorted points, normalised to 1, and the sorting index. They are
+        computed (with a single sort) the first time they are needed, and kept
+        until the points change.
+        """
+        if param not in self._sorted_columns:
+            values = self.points(param)
+            if not len(values):
+                raise ValueError("The chain has no points.")
+            order = np.argsort(values, kind="mergesort")
+            cumulative = np.cumsum(
+                np.asarray(self.points("#"), dtype=np.float64)[order])
+            if cumulative[-1] <= 0:
+                raise ValueError("The points of the chain have no weight.")
+            cumulative /= cumulative[-1]
+            self._sorted_columns[param] = (values[order], cumulative, order)
+        return self._sorted_columns[param]
+    def has_index(self, param):
+        """
+        Returns True if the sorted column of 'param' (used by 'quantile' and
+        'select') has already been built.
+        """
+        return param in self._sorted_columns
+    def quantile(self, param, q):
+        """
+        Returns the weighted quantile(s) 'q' (in [0, 1], a number or a list)
+        of 'param'.
+
+        After the first call for a parameter, any number of quantiles of it
+        cost O(log n), since its sorted column is kept.
+        """
+        values, cumulative, _ = self._sorted_column(param)
+        quantiles = _interpolate_sorted(q, cumulative, values)
+        return quantiles if np.ndim(q) else quantiles[0]
+    def median(self, param):
+        """
+        Returns the weighted median of 'param'.
+        """
+        return self.quantile(param, 0.5)
+    def credible_interval(self, param, level=0.683, hpd=False):
+        """
+        Returns the bounds [lower, upper] of the credible interval of 'param'
+        containing the given fraction 'level' of the weight of the points:
+        the central one (equal weight at both sides) by default, or, if 'hpd'
+        is True, the highest posterior density (i.e. shortest) one.
+        """
+        assert 0 < level < 1, "The level must be a fraction in (0, 1)."
+        if not hpd:
+            return self.quantile(param, [(1-level)/2., (1+level)/2.])
+        values, cumulative, _ = self._sorted_column(param)
+        # For each first point, the last one needed to reach the level
+        before = np.concatenate([[0.], cumulative[:-1]])
+        last = np.searchsorted(cumulative, before + level*(1 - 1e-12))
+        valid = np.flatnonzero(last < len(values))
+        first = valid[np.argmin(values[last[valid]] - values[valid])]
+        return np.array([values[first], values[last[first]]])
+
+    # Summary statistics
+    def summary(self, params=None):
+        """
+        Returns an ordered dictionary whose keys are the given parameters
+        (default: all) and whose values are dictionaries of their:
+
+        * "r_minus_1": Gelman-Rubin R-1 (NaN with a single chain file)
+        * "best_fit": value at the best fit point
+        * "mean", "std": weighted mean and standard deviation
+        * "lower_68", "upper_68", "lower_95", "upper_95": bounds of the 68% and
+          95% central credible intervals (weighted quantiles 16%, 84%, 2.5%
+          and 97.5%)
+        * "minus_68", "plus_68", "minus_95", "plus_95": those bounds relative
+          to the mean
+
+        The bounds are found in the sorted columns (see 'quantile').
+        """
+        if params is None:
+            params = self.parameters()
+        params = list(params)
+        indices = [self.index_of_param(p) for p in params]
+        quantiles = [self.quantile(p, [0.16, 0.84, 0.025, 0.975])
+                     for p in params]
+        means = self.mean()[indices]
+        stds = np.sqrt(np.diag(self.covariance())[indices])
+        try:
+            r_minus_1 = self.convergence()[indices]
+        except ValueError:
+            r_minus_1 = np.nan * np.ones(len(params))
+        best_fit = self.best_fit(params=params)[0]
+        summary = OrderedDict()
+        for k, param in enumerate(params):
+            stats = {"r_minus_1": r_minus_1[k], "best_fit": best_fit[k],
+                     "mean": means[k], "std": stds[k]}
+            for bound, q in zip(["lower_68", "upper_68", "lower_95", "upper_95"],
+                                quantiles[k]):
+                stats[bound] = q
+            for cl in ["68", "95"]:
+                stats["minus_" + cl] = stats["lower_" + cl] - means[k]
+                stats["plus_" + cl] = stats["upper_" + cl] - means[k]
+            summary[param] = stats
+        return summary
+    def write_summary(self, base_name, params=None):
+        """
+        Writes the 'summary' of the given parameters (default: all) to the
+        files '<base_name>.h_info' and '<base_name>.v_info' (horizontal and
+        vertical tables) and '<base_name>.tex' (LaTeX table), in the formats of
+        MontePython.
+
+        Returns the list of files written.
+        """
+        summary = self.summary(params)
+        min_mloglik = self.best_fit(param="mloglik")[0]
+        contents = [(".h_info", _summary_h_info(summary)),
+                    (".v_info", _summary_v_info(summary)),
+                    (".tex", _summary_latex(summary, self._param_labels,
+                                            min_mloglik))]
+        files = []
+        for extension, text in contents:
+            with open(base_name + extension, "w") as sfile:
+                sfile.write(text)
+            files.append(base_name + extension)
+        return files
+
     def plot_correlation(self, params=None, save_file=None,
                          dpi=150, transparent=False, turn_labels=False,
                          fontsize_params=16):
@@ -360,10 +1521,9 @@ class Chain():
 
         """
         if params:
-            correlations = np.ones(shape=(len(params), len(params)))
-            for i, param1 in enumerate(params):
-                for j, param2 in enumerate(params):
-                    correlations[i, j] = self.correlation(param1, param2)
+            params = list(params)
+            indices = [self.index_of_param(p) for p in params]
+            correlations = self.correlation()[np.ix_(indices, indices)]
         else:
             params = self.parameters()
             correlations = self.correlation()
@@ -470,3 +1630,143 @@ class Chain():
                 return parameters
         else:
             raise NotImplementedError("Not implemented for CosmoMC")
+
+
+class ChainView(Chain):
+    """
+    Lazy view of the points of one or more chains, e.g. after removing the
+    burn-in, thinning them or filtering them: it behaves as a 'Chain', but it
+    only stores which rows of the original chains it contains.
+
+    The points are read from the original chains block by block (see
+    'iter_blocks'), so that e.g. means, covariances and likelihood grids are
+    computed without copying them; they are put together in a single array
+    only when needed, e.g. by 'points()' (a single column, if a parameter is
+    given).
+
+    The rows of a view are fixed when it is created: after a 'refresh' of the
+    original chains, a new view must be created to include the new points.
+
+    Views are not created directly, but with 'Chain.merge', and the methods
+    'burn_in', 'thin' and 'filter' of chains (and views).
+
+    Mandatory arguments:
+    --------------------
+
+    parts: list of (chain, file, rows)
+        The rows of the points of each 'Chain' instance ('rows', a slice or an
+        array of indices) coming from each chain file.
+
+    Optional arguments:
+    -------------------
+
+    name: str (default: None, i.e. that of the first chain)
+
+    """
+    def __init__(self, parts, name=None):
+        bases = []
+        for base, _, _ in parts:
+            if base not in bases:
+                bases.append(base)
+        if not bases:
+            raise ValueError("A view needs at least one chain.")
+        first = bases[0]
+        for base in bases[1:]:
+            if base.parameters() != first.parameters():
+                raise ValueError("Only chains with the same parameters can be "
+                                 "merged: '%s' and '%s'."%(first.name(),
+                                                           base.name()))
+        # Description of the parameters, from the first chain
+        for attr in ["_folder", "_prefix", "_code", "_cache_dir", "_raw_params",
+                     "_file_params", "_file_columns", "_sorted_varying_params",
+                     "_sorted_derived_params"]:
+            setattr(self, attr, getattr(first, attr))
+        self._name = name or first.name()
+        self._param_labels = dict(first._param_labels)
+        self._build_param_index()
+        self._dtype = np.result_type(*[base._dtype for base in bases])
+        self._cache = False
+        self._stream = False
+        self._moments = None
+        self._file_moments = None
+        self._autocorr = None
+        self._sorted_columns = {}
+        self._best_fit_index = None
+        # Parts, and rows of the view coming from each of them
+        self._parts = []
+        self._segments = []
+        self._chains = []
+        start = 0
+        for base, chain, rows in parts:
+            n_rows = _row_count(rows)
+            if not n_rows:
+                continue
+            self._parts.append((base, chain, rows))
+            self._segments.append([chain, start, start + n_rows])
+            if chain not in self._chains:
+                self._chains.append(chain)
+            start += n_rows
+    def __getattr__(self, attr):
+        # The points are put together the first time they are needed
+        if attr == "_points":
+            if self._parts:
+                self._points = np.concatenate(
+                    [base._points[rows] for base, _, rows in self._parts])
+            else:
+                self._points = np.empty(
+                    shape=(0, 2 + len(self.parameters())), dtype=self._dtype)
+            return self._points
+        raise AttributeError(attr)
+    def _view_parts(self):
+        return list(self._parts)
+    def _values_at(self, param, rows):
+        # Read from the original chains, without putting the points together
+        column = self.index_of_param(param, chain=True)
+        starts = np.cumsum([0] + [_row_count(r) for _, _, r in self._parts])
+        bounds = np.searchsorted(rows, starts)
+        pieces = [base._points[_select_rows(r, rows[bounds[k]:bounds[k+1]] -
+                                            starts[k]), column]
+                  for k, (base, _, r) in enumerate(self._parts)]
+        if not pieces:
+            return np.empty(0, dtype=self._dtype)
+        return np.concatenate(pieces)
+    def refresh(self):
+        """
+        The rows of a view are fixed: does nothing and returns 0.
+        """
+        return 0
+    def identity(self):
+        """
+        Hashable description of the points of the view: the identities of the
+        original chains, and the rows taken from them.
+        """
+        return ("view",) + tuple((base.identity(), chain, _rows_key(rows))
+                                 for base, chain, rows in self._parts)
+    def points(self, param=None):
+        """
+        As 'Chain.points'. If a parameter is given and the points have not been
+        put together yet, only its column is.
+        """
+        if param and "_points" not in self.__dict__:
+            column = self.index_of_param(param, chain=True)
+            if not self._parts:
+                return np.empty(0, dtype=self._dtype)
+            return np.concatenate([base._points[rows, column]
+                                   for base, _, rows in self._parts])
+        return Chain.points(self, param)
+    def iter_blocks(self, params=None, block_size=100000, files=None):
+        """
+        As 'Chain.iter_blocks', reading the blocks directly from the original
+        chains, i.e. without putting all the points together.
+        """
+        if params is None:
+            columns = slice(None)
+        else:
+            columns = [self.index_of_param(p, chain=True) for p in params]
+        for base, chain, rows in self._parts:
+            if files is not None and chain not in files:
+                continue
+            for start in range(0, _row_count(rows), block_size):
+                block = base._points[_select_rows(
+                    rows, slice(start, start + block_size))]
+                yield block if params is None else block[:, columns]
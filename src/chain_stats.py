@@ -0,0 +1,100 @@
+###############################################
+# Vectorised statistics of weighted samples,  #
+# computable block by block (e.g. for chains) #
+###############################################
+
+import numpy as np
+
+class WeightedMoments():
+    """
+    Weighted means and covariance matrix of a set of variables, accumulated
+    in a single pass over blocks of samples.
+
+    Two instances can be merged, e.g. to combine the moments of different
+    chains, or those computed by different processes. The merging is
+    numerically stable (Chan et al.), so blocks can be of any size.
+
+    Mandatory arguments:
+    --------------------
+
+    n_vars: int
+        Number of variables.
+
+    """
+    def __init__(self, n_vars):
+        self._weight = 0.
+        # sum_i w_i^2, for the effective number of samples
+        self._weight2 = 0.
+        self._mean = np.zeros(n_vars)
+        # sum_i w_i (x_i - mean) (x_i - mean)^T
+        self._comoment = np.zeros(shape=(n_vars, n_vars))
+    def update(self, weights, values):
+        """
+        Adds a block of samples: 'values' has one row per sample, and one
+        column per variable, and 'weights' one weight per sample.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        weight = weights.sum()
+        if weight == 0:
+            return
+        mean = weights.dot(values) / weight
+        deviations = values - mean
+        comoment = (deviations * weights[:, np.newaxis]).T.dot(deviations)
+        self._weight2 += weights.dot(weights)
+        self._merge(weight, mean, comoment)
+    def merge(self, other):
+        """
+        Adds the samples accumulated by another instance.
+        """
+        self._weight2 += other._weight2
+        self._merge(other._weight, other._mean, other._comoment)
+    def _merge(self, weight, mean, comoment):
+        total = self._weight + weight
+        if total == 0:
+            return
+        delta = mean - self._mean
+        self._comoment += (comoment +
+                           np.outer(delta, delta) * self._weight * weight / total)
+        self._mean += delta * weight / total
+        self._weight = total
+    def select(self, indices):
+        """
+        Returns a new instance with the moments of only the variables with the
+        given indices (in that order).
+        """
+        indices = np.asarray(indices, dtype=int)
+        selected = WeightedMoments(len(indices))
+        selected._weight = self._weight
+        selected._weight2 = self._weight2
+        selected._mean = self._mean[indices]
+        selected._comoment = self._comoment[np.ix_(indices, indices)]
+        return selected
+    def weight(self):
+        """
+        Sum of the weights of the samples.
+        """
+        return self._weight
+    def effective_size(self):
+        """
+        Effective number of samples (Kish): (sum_i w_i)^2 / sum_i w_i^2.
+        """
+        if self._weight2 == 0:
+            return 0.
+        return self._weight**2 / self._weight2
+    def mean(self):
+        """
+        Weighted means of the variables.
+        """
+        return self._mean.copy()
+    def covariance(self):
+        """
+        Weighted covariance matrix of the variables.
+        """
+        return self._comoment / self._weight
+    def correlation(self):
+        """
+        Correlation matrix of the variables.
+        """
+        std = np.sqrt(np.diag(self._comoment))
+        return self._comoment / np.outer(std, std)
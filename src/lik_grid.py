@@ -0,0 +1,1312 @@
+###########################################################
+# Binning of chain points into grids of likelihood values #
+###########################################################
+
+import os
+import hashlib
+from collections import OrderedDict
+from multiprocessing import Pool
+import numpy as np
+
+# Local imports
+from Chain import Chain
+from chain_stats import WeightedMoments
+
+def grid_limits(chains, params, limits=None):
+    """
+    Returns the limits [[min_1, max_1], [min_2, max_2], ...] of the grid for the
+    given parameters: those given in 'limits' (a list with one [min, max] or
+    None per parameter), or, where not given, the extrema of all the points in
+    the chains.
+    """
+    limits_new = [[None, None] for param in params]
+    if limits:
+        for i in range(len(params)):
+            if limits[i]:
+                for j in [0, 1]:
+                    limits_new[i][j] = limits[i][j]
+    for i, param in enumerate(params):
+        if limits_new[i][0] is None:
+            limits_new[i][0] = min([chain.get_min(param) for chain in chains])
+            limits_new[i][1] = max([chain.get_max(param) for chain in chains])
+    for i in range(len(params)):
+        assert limits_new[i][1] > limits_new[i][0], (
+            "The given limits are not well formatted: min > max.")
+    return limits_new
+
+def bin_likelihood_1D(chains, params, mode, limits=None, n_grid=100,
+                      n_workers=1, block_size=100000, cache=None):
+    """
+    Bins the points of the given chains along each of the given parameters,
+    all of them in a single pass over the points, and returns the
+    [marginal|mean|profile] likelihood in each cell, meaning
+
+    * Mean:      (sum_i #_i * -loglik_i) / (sum_i #_i)
+    * Marginal:  (sum_i #_i), normalised to a maximum of 1
+    * Profile:   min(-loglik_i)
+
+    being the sums over 'i' extended to all chain points falling within a given
+    cell, and being '#_i' the number of stops of the chain point 'i'. Empty
+    cells are set to 'inf' in the "mean" and "profile" modes, and to 0 in the
+    "marginal" one.
+
+    Returns a dictionary with the likelihood of each parameter, or just the
+    likelihood if a single parameter name is given.
+
+    Mandatory arguments:
+    --------------------
+
+    chains: list of 'Chain' instances
+
+    params: parameter name, or list of them (e.g. 'chain.parameters()')
+
+    mode: one of ["marginal", "mean", "profile"]
+
+    Optional arguments:
+    -------------------
+
+    limits: list of [min, max] or None, one per parameter (default: None)
+        Limits of the grids (see 'grid_limits'). Points outside are ignored.
+
+    n_grid: int (default: 100)
+        Number of cells along each parameter.
+
+    n_workers: int (default: 1)
+        Number of processes among which the blocks of points are distributed.
+
+    block_size: int (default: 100000)
+        Number of points binned at a time.
+
+    cache: 'GridCache' instance (default: None)
+        If given, the binned points are looked up in (or stored into) it.
+
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    assert mode in ["marginal", "mean", "profile"], (
+        "Mode not recognised: '%s'."%mode)
+    single = not isinstance(params, (list, tuple))
+    if single:
+        params = [params]
+        if limits:
+            limits = [limits]
+    grids = accumulate_likelihood_1D(chains, params, limits, n_grid,
+                                     n_workers=n_workers,
+                                     block_size=block_size, cache=cache)
+    curves = dict((param, grid.likelihood(mode))
+                  for param, grid in grids.items())
+    return curves[params[0]] if single else curves
+
+def accumulate_likelihood_1D(chains, params, limits=None, n_grid=100,
+                             n_workers=1, block_size=100000, cache=None):
+    """
+    Bins the points of the given chains along each of the given parameters,
+    all of them in a single pass over the points, and returns a dictionary
+    with the 1D 'LikelihoodAccumulator' of each parameter (see
+    'bin_likelihood_1D' for the arguments), whose limits are those of the grid.
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    params = list(params)
+    n_grid = abs(int(n_grid))
+    key = _cache_key("1D", chains, params, limits, [n_grid])
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        limits = _unpack_limits(cached)
+        grids = [_unpack(cached, "1D_%d_"%k, [param], [limits[k]], [n_grid])
+                 for k, param in enumerate(params)]
+    else:
+        limits = grid_limits(chains, params, limits)
+        grids = _bin_grids(chains, params, limits, n_grid, n_workers,
+                           block_size, pairs=False)[0]
+        if cache:
+            packed = _pack_limits(limits)
+            for k in range(len(params)):
+                packed.update(_pack(grids[k], "1D_%d_"%k))
+            cache.put(key, packed)
+    return dict(zip(params, grids))
+
+def bin_likelihood_2D(chains, params, mode, limits=None, dims=(100, 100),
+                      n_workers=1, block_size=100000, cache=None,
+                      use_index=False):
+    """
+    Bins the points of the given chains in a grid over the given parameters,
+    and returns the matrix of the [marginal|mean|profile] likelihood, meaning
+
+    * Mean:      (sum_i #_i * -loglik_i) / (sum_i #_i)
+    * Marginal:  log(e * sum_i #_i)
+    * Profile:   min(-loglik_i)
+
+    being the sums over 'i' extended to all chain points falling within a given
+    cell, and being '#_i' the number of stops of the chain point 'i'.
+
+    The element [i, j] of the matrix corresponds to the i-th cell of the first
+    parameter and the j-th of the second one. Empty cells are set to 'inf' in
+    the "mean" and "profile" modes, and to minus the maximum in the "marginal"
+    one.
+
+    Mandatory arguments:
+    --------------------
+
+    chains: list of 'Chain' instances
+
+    params: list of 2 parameter names
+
+    mode: one of ["marginal", "mean", "profile"]
+
+    Optional arguments:
+    -------------------
+
+    limits: list of 2 [min, max] (default: None)
+        Limits of the grid (see 'grid_limits'). Points outside are ignored.
+
+    dims: list of 2 int (default: [100, 100])
+        Number of cells along each parameter.
+
+    n_workers, block_size, use_index:
+        See 'accumulate_likelihood'.
+
+    cache: 'GridCache' instance (default: None)
+        If given, the binned points are looked up in (or stored into) it.
+        Since the statistics of all the modes are cached together, a change
+        of mode also hits the cache.
+
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    assert mode in ["marginal", "mean", "profile"], (
+        "Mode not recognised: '%s'."%mode)
+    dims = [int(d) for d in dims]
+    return accumulate_likelihood(chains, params, limits, dims,
+                                 n_workers=n_workers, block_size=block_size,
+                                 cache=cache,
+                                 use_index=use_index).likelihood(mode)
+
+def accumulate_likelihood(chains, params, limits=None, dims=(100, 100),
+                          n_workers=1, block_size=100000, cache=None,
+                          use_index=False):
+    """
+    Bins the points of the given chains in a grid over the given parameters,
+    and returns the resulting 'LikelihoodAccumulator', from which the
+    likelihood of any mode can be obtained.
+
+    The points are read and binned block by block, so if the chains are
+    opened with 'stream=True', the memory needed is bounded by the block size,
+    however big the chains. The blocks can be spread over a number of
+    processes, whose partial grids are merged.
+
+    Mandatory arguments:
+    --------------------
+
+    chains: list of 'Chain' instances
+
+    params: list of parameter names
+
+    Optional arguments:
+    -------------------
+
+    limits: list of [min, max] (default: None)
+        Limits of the grid (see 'grid_limits'). Points outside are ignored.
+
+    dims: list of int (default: [100, 100])
+        Number of cells along each parameter.
+
+    n_workers: int (default: 1)
+        Number of processes among which the blocks of points are distributed.
+
+    block_size: int (default: 100000)
+        Number of points binned at a time.
+
+    cache: 'GridCache' instance (default: None)
+        If given, the grid is looked up in (or stored into) it.
+
+    use_index: bool (default: False)
+        If True, the points within the given limits are found with
+        'Chain.select', without going through the rest (for chains in memory).
+        Sorting the columns the first time is slower than a single pass over
+        the points, and the sorted columns are kept, so it pays off only when
+        zooming repeatedly into small regions. Otherwise, the sorted columns
+        are used only if they have already been built.
+
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    params = list(params)
+    given_limits = limits
+    dims = [int(d) for d in dims]
+    key = _cache_key("grid", chains, params, limits, dims)
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return _unpack(cached, "", params, _unpack_limits(cached), dims)
+    limits = grid_limits(chains, params, limits)
+    chains = _select_in_limits(chains, params, given_limits, limits, use_index)
+    grid = LikelihoodAccumulator(params, limits, dims)
+    if n_workers > 1:
+        jobs = ((block, params, limits, dims)
+                for chain in chains
+                for block in chain.iter_blocks(["#", "mloglik"] + params,
+                                               block_size=block_size))
+        pool = Pool(n_workers)
+        try:
+            for partial in pool.imap_unordered(_accumulate_block, jobs):
+                grid.merge(partial)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for chain in chains:
+            grid.add_chain(chain, block_size=block_size)
+    if cache:
+        packed = _pack_limits(limits)
+        packed.update(_pack(grid, ""))
+        cache.put(key, packed)
+    return grid
+
+def _select_in_limits(chains, params, given_limits, limits, use_index=False):
+    """
+    Returns the given chains restricted to their points within the limits of
+    the grid 'limits' of the parameters whose limits were given (see
+    'grid_limits'), found with 'Chain.select', if 'use_index' or if the
+    chain has already sorted those columns.
+
+    Other chains (e.g. those whose points are not in memory) are returned as
+    they are: the points outside the limits are dropped when binning anyway.
+    """
+    ranges = dict((param, limits[k]) for k, param in enumerate(params)
+                  if given_limits and given_limits[k] and
+                  given_limits[k][0] is not None)
+    if not ranges:
+        return chains
+    selected = []
+    for chain in chains:
+        if not (use_index or all(chain.has_index(p) for p in ranges)):
+            selected.append(chain)
+            continue
+        try:
+            selected.append(chain.select(**ranges))
+        except ValueError:
+            selected.append(chain)
+    return selected
+
+def _accumulate_block(job):
+    """
+    Grid of a single block of points.
+
+    (Module-level function, so that it can be sent to a process pool.)
+    """
+    block, params, limits, dims = job
+    grid = LikelihoodAccumulator(params, limits, dims)
+    grid.update(block)
+    return grid
+
+def credible_levels(weights, fractions=(0.683, 0.954)):
+    """
+    Returns the values of the given grid of weights (e.g. the sum of the
+    weights of the points in each cell of a marginal grid) above which the
+    given fractions of the total weight are contained, i.e. the levels of the
+    contours of the highest-density credible regions.
+
+    The cells are sorted by weight only once, so it is fast for any grid size.
+    """
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+    ordered = np.sort(weights)[::-1]
+    cumulative = np.cumsum(ordered)
+    if cumulative[-1] <= 0:
+        raise ValueError("The grid contains no weight.")
+    cumulative /= cumulative[-1]
+    positions = np.searchsorted(cumulative, fractions)
+    return ordered[np.minimum(positions, len(ordered)-1)]
+
+def gaussian_smooth(grid, sigma):
+    """
+    Convolves the given grid (of any dimension) with a Gaussian kernel, using
+    FFT's, i.e. with a cost O(G log G) in the number of cells G.
+
+    'sigma' is the standard deviation of the kernel in units of cells: either
+    a number, one per dimension, or a covariance matrix (for correlated
+    kernels). The grid is padded with zeros, so that nothing leaks from one
+    side to the opposite one.
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    ndim = grid.ndim
+    sigma = np.asarray(sigma, dtype=np.float64)
+    if sigma.ndim < 2:
+        covariance = np.diag(np.ones(ndim) * sigma**2)
+    else:
+        covariance = sigma
+    assert covariance.shape == (ndim, ndim), (
+        "The kernel must be given for each of the %d dimensions."%ndim)
+    pads = [int(np.ceil(4*np.sqrt(covariance[k, k]))) for k in range(ndim)]
+    shape = [n + 2*pad for n, pad in zip(grid.shape, pads)]
+    inner = tuple(slice(pad, pad + n) for n, pad in zip(grid.shape, pads))
+    padded = np.zeros(shape)
+    padded[inner] = grid
+    # Fourier transform of the kernel: exp(-2 pi^2 f^T C f)
+    freqs = [np.fft.fftfreq(n) for n in shape[:-1]]
+    freqs.append(np.arange(shape[-1]//2 + 1) / float(shape[-1]))
+    exponent = 0
+    for k in range(ndim):
+        for l in range(ndim):
+            if covariance[k, l] == 0:
+                continue
+            shape_k = [1]*ndim
+            shape_k[k] = len(freqs[k])
+            shape_l = [1]*ndim
+            shape_l[l] = len(freqs[l])
+            exponent = exponent + (covariance[k, l] * freqs[k].reshape(shape_k) *
+                                   freqs[l].reshape(shape_l))
+    transfer = np.exp(-2 * np.pi**2 * exponent)
+    smooth = np.fft.irfftn(np.fft.rfftn(padded) * transfer, shape)[inner]
+    # Remove the ringing of the FFT around empty regions
+    return np.clip(smooth, 0, None)
+
+def kde_bandwidth(chains, params, limits, dims, factor=1.):
+    """
+    Returns the covariance matrix, in units of cells of the given grid, of the
+    Gaussian kernel of a density estimate of the posterior of the given chains
+    in the given parameters (e.g. for 'gaussian_smooth').
+
+    It is the weighted covariance matrix of the points of all the chains,
+    scaled by Scott's factor n^(-2/(d+4)), being 'n' the effective number of
+    points (given their weights) and 'd' the number of parameters, and by
+    'factor' squared (i.e. 'factor' multiplies the width of the kernel).
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    if not chains:
+        raise ValueError("The bandwidth needs at least one chain.")
+    moments = WeightedMoments(len(params))
+    for chain in chains:
+        moments.merge(chain.moments(params))
+    n_eff = moments.effective_size()
+    if n_eff == 0:
+        raise ValueError("The chains contain no weight.")
+    scale = factor**2 * n_eff**(-2./(len(params) + 4))
+    steps = np.array([(lim[1] - lim[0]) / float(d)
+                      for lim, d in zip(limits, dims)])
+    return scale * moments.covariance() / np.outer(steps, steps)
+
+def kde_weights(grid, chains, factor=1.):
+    """
+    Returns the sum of the weights per cell of the given 'LikelihoodAccumulator'
+    smoothed with a Gaussian kernel whose bandwidth is computed from the
+    weighted covariance of the given chains (see 'kde_bandwidth'), i.e. a
+    kernel density estimate of their marginal posterior on the grid.
+
+    The cost depends only on the size of the grid, not on the number of points.
+    """
+    covariance = kde_bandwidth(chains, grid.params(), grid.limits(),
+                               grid.dims(), factor)
+    return gaussian_smooth(grid.weights(), covariance)
+
+def log_marginal(weights):
+    """
+    Marginal likelihood as plotted by 'plot_lik_2D' from the sum of weights of
+    the cells of a grid: log(e * weights), clipped symmetrically so that empty
+    cells do not dominate the colour scale.
+    """
+    with np.errstate(divide="ignore"):
+        matrix = np.log(np.e*np.asarray(weights, dtype=np.float64))
+    maxlogsteps = matrix.max()
+    return matrix.clip(-maxlogsteps, maxlogsteps)
+
+def bin_profile_adaptive(chains, params, limits=None, dims=(100, 100),
+                         levels=3, min_points=10, min_variation=0.5,
+                         cache=None):
+    """
+    Bins the points of the given chains in an adaptive (quadtree-like) grid
+    over the given parameters, and returns the profile likelihood in it,
+    i.e. min(-loglik_i) over the points 'i' falling in each cell.
+
+    The binning starts from a coarse grid with 'dims / 2^levels' cells, and
+    each cell is subdivided in 4 only if it contains at least 'min_points'
+    points and their -loglik varies more than 'min_variation', until the
+    resolution of 'dims' is reached. This way, the resolution is highest where
+    the likelihood changes fast (e.g. around the best fit), with much fewer
+    cells than a uniform grid with the same resolution.
+
+    Returns a tuple '(cells, profile)', where 'cells' is an array with the
+    [x_min, x_max, y_min, y_max] of a (non-empty) cell per row, and 'profile'
+    contains the -loglik of each of them.
+
+    Mandatory arguments:
+    --------------------
+
+    chains: list of 'Chain' instances
+
+    params: list of 2 parameter names
+
+    Optional arguments:
+    -------------------
+
+    limits: list of 2 [min, max] (default: None)
+        Limits of the grid (see 'grid_limits'). Points outside are ignored.
+
+    dims: list of 2 int (default: [100, 100])
+        Number of cells along each parameter at the finest resolution.
+
+    levels: int (default: 3)
+        Number of times the coarsest cells can be subdivided.
+
+    min_points: int (default: 10)
+        Minimum number of points in a cell for it to be subdivided.
+
+    min_variation: float (default: 0.5)
+        Minimum difference between the largest and smallest -loglik of the
+        points in a cell for it to be subdivided.
+
+    cache: 'GridCache' instance (default: None)
+        If given, the result is looked up in (or stored into) it.
+
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    levels = abs(int(levels))
+    base = [max(1, int(round(int(d) / 2.**levels))) for d in dims]
+    key = _cache_key("adaptive", chains, params, limits, base) + (
+        levels, int(min_points), float(min_variation))
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return cached["cells"], cached["profile"]
+    limits = grid_limits(chains, params, limits)
+    steps = [(limits[k][1] - limits[k][0]) / float(base[k] * 2**levels)
+             for k in [0, 1]]
+    # Count, min and max of -loglik in the occupied cells of the finest level,
+    # in a single pass over the chains
+    groups = []
+    for chain in chains:
+        for block in chain.iter_blocks(["mloglik", params[0], params[1]]):
+            index, block = _finest_indices(block, limits, base, levels)
+            if len(block):
+                cells = index[0] * (base[1] * 2**levels) + index[1]
+                groups.append(_group_extrema(
+                    cells, np.ones(len(cells)), block[:, 0], block[:, 0]))
+    if groups:
+        stats = [_group_extrema(*[np.concatenate(g) for g in zip(*groups)])]
+    else:
+        stats = [(np.zeros(0, dtype=np.intp),) + 3*(np.zeros(0),)]
+    # ... merged bottom-up into those of the coarser levels
+    for level in range(levels, 0, -1):
+        n_y = base[1] * 2**level
+        cells, count, mini, maxi = stats[0]
+        parents = (cells // n_y >> 1) * (n_y // 2) + (cells % n_y >> 1)
+        stats.insert(0, _group_extrema(parents, count, mini, maxi))
+    # Leaves: the cells whose parent was split, and which are not split
+    leaves = []
+    split = None
+    for level, (cells, count, mini, maxi) in enumerate(stats):
+        shift = levels - level
+        n_y = base[1] * 2**level
+        if split is not None:
+            parents = (cells // n_y >> 1) * (n_y // 2) + (cells % n_y >> 1)
+            keep = _is_in_sorted(parents, split)
+            cells, count, mini, maxi = (
+                cells[keep], count[keep], mini[keep], maxi[keep])
+        divide = (count >= min_points) & (maxi - mini > min_variation)
+        if level == levels:
+            divide[:] = False
+        # [x_min, x_max, y_min, y_max]
+        size = [steps[k] * 2**shift for k in [0, 1]]
+        ix, iy = cells[~divide] // n_y, cells[~divide] % n_y
+        leaves.append((np.column_stack(
+            [limits[0][0] + ix*size[0], limits[0][0] + (ix+1)*size[0],
+             limits[1][0] + iy*size[1], limits[1][0] + (iy+1)*size[1]]),
+            mini[~divide]))
+        split = cells[divide]
+        if not len(split):
+            break
+    if leaves:
+        cells = np.concatenate([leaf[0] for leaf in leaves])
+        profile = np.concatenate([leaf[1] for leaf in leaves])
+    else:
+        cells, profile = np.zeros(shape=(0, 4)), np.zeros(0)
+    if cache:
+        cache.put(key, {"cells": cells, "profile": profile})
+    return cells, profile
+
+def bin_likelihood_triangle(chains, params, limits=None, n_grid=50,
+                            n_workers=1, block_size=100000, cache=None):
+    """
+    Bins the points of the given chains, in a single pass over them, in a 1D
+    grid for each of the given parameters and in a 2D grid for each pair of
+    them, as needed for a triangle plot.
+
+    Returns a tuple '(limits, grids_1D, grids_2D)', where 'limits' are the
+    limits of the grids (see 'grid_limits'), 'grids_1D[param]' the 1D grid of
+    'param', and 'grids_2D[(param_1, param_2)]' the 2D grid of each pair, with
+    'param_1' preceding 'param_2' in 'params', all of them instances of
+    'LikelihoodAccumulator', from which the likelihood of any mode can be
+    obtained.
+
+    Mandatory arguments:
+    --------------------
+
+    chains: list of 'Chain' instances
+
+    params: list of parameter names
+
+    Optional arguments:
+    -------------------
+
+    limits: list of [min, max] (default: None)
+        Limits of the grids (see 'grid_limits'). Points outside are ignored.
+
+    n_grid: int (default: 50)
+        Number of cells along each parameter.
+
+    n_workers: int (default: 1)
+        Number of processes among which the blocks of points are distributed.
+
+    block_size: int (default: 100000)
+        Number of points binned at a time.
+
+    cache: 'GridCache' instance (default: None)
+        If given, the binned points are looked up in (or stored into) it.
+
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    params = list(params)
+    assert len(set(params)) == len(params), "The parameters must be different."
+    n_grid = abs(int(n_grid))
+    n = len(params)
+    key = _cache_key("triangle", chains, params, limits, [n_grid])
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        limits = _unpack_limits(cached)
+        results = ([_unpack(cached, "1D_%d_"%k, [params[k]], [limits[k]],
+                            [n_grid]) for k in range(n)],
+                   dict(((k, l), _unpack(cached, "2D_%d_%d_"%(k, l),
+                                         [params[k], params[l]],
+                                         [limits[k], limits[l]], [n_grid]*2))
+                        for k in range(n) for l in range(k+1, n)))
+    else:
+        limits = grid_limits(chains, params, limits)
+        results = _bin_grids(chains, params, limits, n_grid,
+                             n_workers, block_size)
+        if cache:
+            packed = _pack_limits(limits)
+            for k in range(n):
+                packed.update(_pack(results[0][k], "1D_%d_"%k))
+            for (k, l), grid in results[1].items():
+                packed.update(_pack(grid, "2D_%d_%d_"%(k, l)))
+            cache.put(key, packed)
+    grids_1D = dict(zip(params, results[0]))
+    grids_2D = dict(((params[k], params[l]), results[1][(k, l)])
+                    for (k, l) in results[1])
+    return limits, grids_1D, grids_2D
+
+def _bin_grids(chains, params, limits, n_grid, n_workers, block_size,
+               pairs=True):
+    """
+    1D grids of the given parameters and, if 'pairs', 2D grids of each pair
+    of them (as in a triangle plot, see 'bin_likelihood_triangle'), indexed by
+    the position of the parameters.
+    """
+    jobs = ((block, params, limits, n_grid, pairs)
+            for chain in chains
+            for block in chain.iter_blocks(["#", "mloglik"] + params,
+                                           block_size=block_size))
+    results = None
+    if n_workers > 1:
+        pool = Pool(n_workers)
+        try:
+            for result in pool.imap_unordered(_bin_grids_block, jobs):
+                results = _merge_grids(results, result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            results = _merge_grids(results, _bin_grids_block(job))
+    if results is None:
+        results = _empty_grids(params, limits, n_grid, pairs)
+    return results
+
+class GridCache():
+    """
+    Cache of binned chain points (see 'bin_likelihood_2D' and
+    'bin_likelihood_triangle'), so that plots of the same chains, parameters
+    and grid differing only in cosmetic options do not bin the points again.
+
+    The most recently used results are kept in memory, and, optionally, in
+    a folder, where they persist between sessions.
+
+    Optional arguments:
+    -------------------
+
+    max_entries: int (default: 32)
+        Maximum number of results kept in memory: the least recently used
+        ones are dropped first.
+
+    max_size: int (default: 256 MB)
+        Maximum size in bytes of the results kept in memory (idem). A result
+        bigger than it is not kept.
+
+    cache_dir: str (default: None)
+        Folder in which to store the results, one '.npz' file each.
+
+    max_disk_size: int (default: 256 MB)
+        Maximum size in bytes of the files in 'cache_dir': the least recently
+        used ones are deleted first.
+
+    """
+    def __init__(self, max_entries=32, cache_dir=None, max_disk_size=2**28,
+                 max_size=2**28):
+        self._max_entries = max_entries
+        self._max_size = max_size
+        self._size = 0
+        self._cache_dir = cache_dir
+        self._max_disk_size = max_disk_size
+        self._memory = OrderedDict()
+    def get(self, key):
+        """
+        Returns (a copy of) the dictionary of arrays stored under the given
+        key, or None if not found.
+        """
+        name = _key_hash(key)
+        if name in self._memory:
+            arrays = self._memory.pop(name)
+            self._memory[name] = arrays
+            return dict((k, v.copy()) for k, v in arrays.items())
+        if not self._cache_dir:
+            return None
+        filename = os.path.join(self._cache_dir, name + ".npz")
+        try:
+            with np.load(filename) as npz:
+                arrays = dict((k, npz[k]) for k in npz.files)
+            # Mark it as recently used
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+        self._remember(name, arrays)
+        return dict((k, v.copy()) for k, v in arrays.items())
+    def put(self, key, arrays):
+        """
+        Stores a dictionary of arrays under the given key.
+        """
+        name = _key_hash(key)
+        arrays = dict((k, np.array(v)) for k, v in arrays.items())
+        self._remember(name, arrays)
+        if not self._cache_dir:
+            return
+        # Write to a temporary file and rename, as for the chain caches;
+        # failing to write it is harmless
+        try:
+            if not os.path.isdir(self._cache_dir):
+                os.makedirs(self._cache_dir)
+            filename = os.path.join(self._cache_dir, name + ".npz")
+            tmp = "%s.%d.tmp"%(filename, os.getpid())
+            with open(tmp, "wb") as npz:
+                np.savez(npz, **arrays)
+            os.rename(tmp, filename)
+        except (IOError, OSError):
+            return
+        self._evict()
+    def clear(self):
+        """
+        Empties the cache, both in memory and on disk.
+        """
+        self._memory.clear()
+        self._size = 0
+        for filename in self._disk_files():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+    def _remember(self, name, arrays):
+        self._forget(name)
+        self._memory[name] = arrays
+        self._size += sum(array.nbytes for array in arrays.values())
+        while self._memory and (len(self._memory) > self._max_entries or
+                                self._size > self._max_size):
+            self._forget(next(iter(self._memory)))
+    def _forget(self, name):
+        arrays = self._memory.pop(name, None)
+        if arrays is not None:
+            self._size -= sum(array.nbytes for array in arrays.values())
+    def _disk_files(self):
+        if not self._cache_dir or not os.path.isdir(self._cache_dir):
+            return []
+        return [os.path.join(self._cache_dir, f)
+                for f in os.listdir(self._cache_dir) if f.endswith(".npz")]
+    def _evict(self):
+        """
+        Deletes the least recently used files until the size limit is met.
+        """
+        files = []
+        for filename in self._disk_files():
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        files.sort()
+        total = sum(size for mtime, size, filename in files)
+        for mtime, size, filename in files:
+            if total <= self._max_disk_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+# Cache used by the plotting functions by default (in memory only)
+default_grid_cache = GridCache()
+
+def _cache_key(kind, chains, params, limits, dims):
+    """
+    Key of a binning of the points of the given chains: everything the result
+    depends on, and nothing else.
+
+    The limits are those given by the user (see 'grid_limits'), so that the
+    key is known without going through the points: those computed from them
+    are stored with the result (see '_pack_limits').
+    """
+    if not limits:
+        limits = [None] * len(params)
+    given = tuple((float(lim[0]), float(lim[1]))
+                  if lim and lim[0] is not None else None for lim in limits)
+    return (kind, tuple(chain.identity() for chain in chains), tuple(params),
+            given, tuple(int(d) for d in dims))
+
+def _pack_limits(limits):
+    return {"limits": np.array(limits, dtype=np.float64)}
+
+def _unpack_limits(arrays):
+    return arrays["limits"].tolist()
+
+def _key_hash(key):
+    return hashlib.md5(repr(key).encode("utf-8")).hexdigest()
+
+def _pack(grid, prefix):
+    return dict((prefix + field, array) for field, array in grid._stats.items())
+
+def _unpack(arrays, prefix, params, limits, dims):
+    grid = LikelihoodAccumulator(params, limits, dims)
+    grid._stats = dict((field, arrays[prefix + field])
+                       for field in ["weights", "weighted_mloglik", "min_mloglik"])
+    return grid
+
+class LikelihoodAccumulator():
+    """
+    Binning state of a grid of likelihood values over some parameters: for
+    each cell, the sum of the weights '#_i' of the points falling in it, the
+    sum of their weighted -loglik '#_i * -loglik_i', and their minimum -loglik.
+
+    It is fed blocks of points one at a time, so that chains of any size can
+    be binned with bounded memory, and two instances of the same grid can be
+    merged, e.g. to combine different chains, or the blocks binned by
+    different processes (instances can be pickled). The result is the same
+    as that of binning all the points at once.
+
+    Mandatory arguments:
+    --------------------
+
+    params: list of parameter names
+
+    limits: list of [min, max], one per parameter
+        Points outside are ignored.
+
+    dims: list of int
+        Number of cells along each parameter.
+
+    """
+    def __init__(self, params, limits, dims):
+        assert len(params) == len(limits) == len(dims), (
+            "There must be limits and dimensions for each parameter.")
+        self._params = list(params)
+        self._limits = [[float(lim[0]), float(lim[1])] for lim in limits]
+        self._dims = [int(d) for d in dims]
+        self._stats = _empty_stats(int(np.prod(self._dims)))
+    def params(self):
+        return self._params
+    def limits(self):
+        return self._limits
+    def dims(self):
+        return self._dims
+    def update(self, block):
+        """
+        Adds a block of points, with columns ['#', 'mloglik', param_1, ...].
+        """
+        cells, block = _cell_indices(block[:, 2:], self._limits, self._dims,
+                                     block)
+        _add_to_stats(self._stats, cells, block[:, 0], block[:, 1])
+        return self
+    def add_chain(self, chain, block_size=100000):
+        """
+        Adds the points of a 'Chain', block by block.
+        """
+        for block in chain.iter_blocks(["#", "mloglik"] + self._params,
+                                       block_size=block_size):
+            self.update(block)
+        return self
+    def merge(self, other):
+        """
+        Adds the points binned by another instance of the same grid.
+        """
+        if (other._params, other._limits, other._dims) != (
+                self._params, self._limits, self._dims):
+            raise ValueError("Only accumulators of the same grid can be merged.")
+        _merge_stats(self._stats, other._stats)
+        return self
+    def weights(self):
+        """
+        Sum of the weights of the points in each cell.
+        """
+        return self._stats["weights"].reshape(self._dims).copy()
+    def weighted_mloglik(self):
+        """
+        Sum of the weighted -loglik of the points in each cell.
+        """
+        return self._stats["weighted_mloglik"].reshape(self._dims).copy()
+    def min_mloglik(self):
+        """
+        Minimum -loglik of the points in each cell ('inf' if empty).
+        """
+        return self._stats["min_mloglik"].reshape(self._dims).copy()
+    def likelihood(self, mode):
+        """
+        Grid of the [marginal|mean|profile] likelihood, as defined in
+        'bin_likelihood_1D' (1 parameter) and 'bin_likelihood_2D' (more).
+        """
+        return _likelihood_from_stats(
+            self._stats, mode,
+            normalised_marginal=(len(self._dims) == 1)).reshape(self._dims)
+
+def _likelihood_from_stats(stats, mode, normalised_marginal=False):
+    """
+    Returns the (flattened) grid of the [marginal|mean|profile] likelihood
+    (see 'bin_likelihood_2D') from the statistics of the cells of a grid.
+
+    If 'normalised_marginal', the marginal likelihood is the sum of the
+    weights normalised to a maximum of 1 (see 'bin_likelihood_1D') instead.
+    """
+    assert mode in ["marginal", "mean", "profile"], (
+        "Mode not recognised: '%s'."%mode)
+    if mode == "marginal" and normalised_marginal:
+        matrix = stats["weights"].copy()
+        if matrix.max() > 0:
+            matrix /= matrix.max()
+    elif mode == "marginal":
+        matrix = log_marginal(stats["weights"])
+    elif mode == "mean":
+        matrix = np.inf * np.ones(len(stats["weights"]))
+        filled = stats["weights"] > 0
+        matrix[filled] = (stats["weighted_mloglik"][filled] /
+                          stats["weights"][filled])
+    elif mode == "profile":
+        matrix = stats["min_mloglik"].copy()
+    return matrix
+
+def _empty_stats(n_cells):
+    """
+    Statistics of the cells of an empty grid: sum of the weights, sum of the
+    weighted -loglik and minimum -loglik.
+    """
+    return {"weights": np.zeros(n_cells),
+            "weighted_mloglik": np.zeros(n_cells),
+            "min_mloglik": np.inf * np.ones(n_cells)}
+
+def _add_to_stats(stats, cells, weights, mloglik):
+    """
+    Adds to the statistics of a grid the points falling in the given cells.
+    """
+    n_cells = len(stats["weights"])
+    stats["weights"] += np.bincount(cells, weights=weights, minlength=n_cells)
+    stats["weighted_mloglik"] += np.bincount(
+        cells, weights=weights*mloglik, minlength=n_cells)
+    _minimum_at(stats["min_mloglik"], cells, mloglik)
+
+def _merge_stats(stats, other):
+    """
+    Adds to the statistics of a grid those of the same grid for other points.
+    """
+    stats["weights"] += other["weights"]
+    stats["weighted_mloglik"] += other["weighted_mloglik"]
+    np.minimum(stats["min_mloglik"], other["min_mloglik"],
+               out=stats["min_mloglik"])
+
+def _empty_grids(params, limits, n_grid, pairs):
+    n = len(params)
+    return ([LikelihoodAccumulator([params[k]], [limits[k]], [n_grid])
+             for k in range(n)],
+            dict(((k, l), LikelihoodAccumulator([params[k], params[l]],
+                                                [limits[k], limits[l]],
+                                                [n_grid, n_grid]))
+                 for k in range(n) for l in range(k+1, n) if pairs))
+
+def _merge_grids(results, other):
+    if results is None:
+        return other
+    for k in range(len(results[0])):
+        results[0][k].merge(other[0][k])
+    for pair in results[1]:
+        results[1][pair].merge(other[1][pair])
+    return results
+
+def _bin_grids_block(job):
+    """
+    1D (and 2D, if 'pairs') grids of a block of points with columns
+    ['#', 'mloglik', param_1, param_2, ...] (see '_bin_grids').
+
+    (Module-level function, so that it can be sent to a process pool.)
+    """
+    block, params, limits, n_grid, pairs = job
+    n_params = len(params)
+    results = _empty_grids(params, limits, n_grid, pairs)
+    weights, mloglik = block[:, 0], block[:, 1]
+    # The cell of each point along each parameter is computed only once
+    inside = []
+    index = []
+    for k in range(n_params):
+        values = block[:, 2+k]
+        inside.append((values >= limits[k][0]) & (values <= limits[k][1]))
+        step = (limits[k][1] - limits[k][0]) / float(n_grid)
+        index_k = np.floor((values - limits[k][0]) / step)
+        np.clip(index_k, 0, n_grid-1, out=index_k)
+        index.append(index_k.astype(np.intp))
+    for k in range(n_params):
+        sel = inside[k]
+        _add_to_stats(results[0][k]._stats, index[k][sel], weights[sel],
+                      mloglik[sel])
+        for l in range(k+1, n_params if pairs else 0):
+            sel = inside[k] & inside[l]
+            cells = index[k][sel] * n_grid + index[l][sel]
+            _add_to_stats(results[1][(k, l)]._stats, cells, weights[sel],
+                          mloglik[sel])
+    return results
+
+def _cell_indices(values, limits, dims, block):
+    """
+    Returns the (flattened) indices of the cells of a grid within 'limits' and
+    with 'dims' cells per dimension in which the given 'values' (one column per
+    dimension) fall, and the rows of 'block' corresponding to those values.
+
+    Values outside the limits are dropped. Those lying on the upper limit are
+    assigned to the last cell.
+    """
+    inside = np.ones(values.shape[0], dtype=bool)
+    for k in range(values.shape[1]):
+        inside &= values[:, k] >= limits[k][0]
+        inside &= values[:, k] <= limits[k][1]
+    if not inside.all():
+        values = values[inside]
+        block = block[inside]
+    cells = np.zeros(values.shape[0], dtype=np.intp)
+    for k in range(values.shape[1]):
+        step = (limits[k][1] - limits[k][0]) / float(dims[k])
+        index = np.floor((values[:, k] - limits[k][0]) / step).astype(np.intp)
+        np.clip(index, 0, dims[k]-1, out=index)
+        cells = cells * dims[k] + index
+    return cells, block
+
+def _finest_indices(block, limits, base, levels):
+    """
+    Indices, along each parameter, of the cells of the finest level of an
+    adaptive grid (see 'bin_profile_adaptive') in which the points of 'block'
+    (columns ['mloglik', param_1, param_2]) fall, and the rows of 'block'
+    within the limits.
+    """
+    dims = [b * 2**levels for b in base]
+    inside = np.ones(block.shape[0], dtype=bool)
+    for k in [0, 1]:
+        inside &= block[:, 1+k] >= limits[k][0]
+        inside &= block[:, 1+k] <= limits[k][1]
+    if not inside.all():
+        block = block[inside]
+    index = []
+    for k in [0, 1]:
+        step = (limits[k][1] - limits[k][0]) / float(dims[k])
+        index_k = np.floor((block[:, 1+k] - limits[k][0]) / step).astype(np.intp)
+        np.clip(index_k, 0, dims[k]-1, out=index_k)
+        index.append(index_k)
+    return index, block
+
+def _group_extrema(cells, counts, minima, maxima):
+    """
+    Groups the given values by cell, and returns the (sorted) unique cells,
+    and the sum of the counts, the minimum of the minima and the maximum of
+    the maxima in each of them.
+    """
+    order = np.argsort(cells, kind="mergesort")
+    cells = cells[order]
+    starts = np.flatnonzero(np.concatenate([[True], cells[1:] != cells[:-1]]))
+    return (cells[starts], np.add.reduceat(counts[order], starts),
+            np.minimum.reduceat(minima[order], starts),
+            np.maximum.reduceat(maxima[order], starts))
+
+def _is_in_sorted(values, sorted_array):
+    """
+    Vectorised 'value in sorted_array' for each of the given values.
+    """
+    if not len(sorted_array):
+        return np.zeros(len(values), dtype=bool)
+    position = np.searchsorted(sorted_array, values)
+    position[position == len(sorted_array)] = 0
+    return sorted_array[position] == values
+
+def _minimum_at(target, indices, values):
+    """
+    Vectorised 'target[i] = min(target[i], v)' for every pair (i, v) in
+    ('indices', 'values'), by sorting and reducing by groups
+    (faster than 'numpy.minimum.at').
+    """
+    if not len(indices):
+        return
+    order = np.argsort(indices, kind="mergesort")
+    indices = indices[order]
+    starts = np.flatnonzero(np.concatenate(
+        [[True], indices[1:] != indices[:-1]]))
+    minima = np.minimum.reduceat(values[order], starts)
+    target[indices[starts]] = np.minimum(target[indices[starts]], minima)
+
+class LikelihoodCube():
+    """
+    Sparse N-dimensional grid of likelihood values over a set of parameters:
+    for each occupied cell, the sum of the weights '#_i' of the points falling
+    in it, the sum of their weighted -loglik '#_i * -loglik_i', and their
+    minimum -loglik (as in 'LikelihoodAccumulator', but only the occupied
+    cells are stored).
+
+    Once built (see 'build_likelihood_cube'), the 1D and 2D grids of any
+    parameters, in any mode and within any limits, can be obtained from it
+    with 'project', without touching the points of the chains again. It can
+    be saved to a file and loaded back ('load_likelihood_cube').
+
+    Mandatory arguments:
+    --------------------
+
+    params: list of parameter names
+
+    limits: list of [min, max], one per parameter
+        Points outside are ignored.
+
+    n_grid: int
+        Number of cells along each parameter.
+
+    """
+    def __init__(self, params, limits, n_grid):
+        assert len(params) == len(limits), (
+            "There must be limits for each parameter.")
+        assert 0 < int(n_grid) <= 2**16, "'n_grid' must be in [1, 65536]."
+        self._params = list(params)
+        self._limits = [[float(lim[0]), float(lim[1])] for lim in limits]
+        self._n_grid = int(n_grid)
+        # Occupied cells: indices along each parameter, and statistics
+        self._cells = np.zeros(shape=(0, len(params)), dtype=np.uint16)
+        self._stats = {"weights": np.zeros(0), "weighted_mloglik": np.zeros(0),
+                       "min_mloglik": np.zeros(0)}
+        # Blocks binned but not yet merged with the rest (see 'update')
+        self._pending = []
+        self._n_pending = 0
+        self._identity = ""
+    def params(self):
+        return self._params
+    def limits(self):
+        return self._limits
+    def n_grid(self):
+        return self._n_grid
+    def n_cells(self):
+        """
+        Number of occupied cells.
+        """
+        self._consolidate()
+        return self._cells.shape[0]
+    def update(self, block):
+        """
+        Adds a block of points, with columns ['#', 'mloglik', param_1, ...].
+        """
+        values = block[:, 2:]
+        inside = np.ones(block.shape[0], dtype=bool)
+        for k in range(values.shape[1]):
+            inside &= values[:, k] >= self._limits[k][0]
+            inside &= values[:, k] <= self._limits[k][1]
+        if not inside.all():
+            block, values = block[inside], values[inside]
+        cells = np.empty(values.shape, dtype=np.uint16)
+        for k in range(values.shape[1]):
+            step = (self._limits[k][1] - self._limits[k][0]) / float(self._n_grid)
+            index = np.floor((values[:, k] - self._limits[k][0]) / step)
+            cells[:, k] = np.clip(index, 0, self._n_grid-1)
+        self._add(_group_rows(cells, block[:, 0], block[:, 0]*block[:, 1],
+                              block[:, 1]))
+        return self
+    def add_chain(self, chain, block_size=100000):
+        """
+        Adds the points of a 'Chain', block by block.
+        """
+        for block in chain.iter_blocks(["#", "mloglik"] + self._params,
+                                       block_size=block_size):
+            self.update(block)
+        return self
+    def merge(self, other):
+        """
+        Adds the points binned by another cube of the same grid.
+        """
+        if (other._params, other._limits, other._n_grid) != (
+                self._params, self._limits, self._n_grid):
+            raise ValueError("Only cubes of the same grid can be merged.")
+        other._consolidate()
+        self._add((other._cells, other._stats["weights"],
+                   other._stats["weighted_mloglik"], other._stats["min_mloglik"]))
+        return self
+    def project(self, params, limits=None):
+        """
+        Returns the 'LikelihoodAccumulator' of the grid over the given
+        parameters (1 or more), with the resolution of the cube, from which the
+        likelihood of any mode can be obtained.
+
+        If 'limits' (a list with one [min, max] or None per parameter) are
+        given, they are widened to the nearest edges of the cells of the cube.
+        """
+        self._consolidate()
+        for param in params:
+            if param not in self._params:
+                raise ValueError("The parameter '%s' is not in the cube."%param)
+        select = np.ones(self._cells.shape[0], dtype=bool)
+        new_limits, first, dims = [], [], []
+        for i, param in enumerate(params):
+            k = self._params.index(param)
+            step = (self._limits[k][1] - self._limits[k][0]) / float(self._n_grid)
+            lo, hi = 0, self._n_grid - 1
+            if limits and limits[i]:
+                lo = int(np.clip(np.floor(
+                    (limits[i][0] - self._limits[k][0]) / step), 0, hi))
+                hi = int(np.clip(np.ceil(
+                    (limits[i][1] - self._limits[k][0]) / step) - 1, lo, hi))
+                select &= ((self._cells[:, k] >= lo) & (self._cells[:, k] <= hi))
+            new_limits.append([self._limits[k][0] + lo*step,
+                               self._limits[k][0] + (hi+1)*step])
+            first.append(lo)
+            dims.append(hi - lo + 1)
+        grid = LikelihoodAccumulator(params, new_limits, dims)
+        flat = np.zeros(select.sum(), dtype=np.intp)
+        for i, param in enumerate(params):
+            k = self._params.index(param)
+            flat = flat * dims[i] + (self._cells[select, k].astype(np.intp) -
+                                     first[i])
+        n_cells = len(grid._stats["weights"])
+        grid._stats["weights"] += np.bincount(
+            flat, weights=self._stats["weights"][select], minlength=n_cells)
+        grid._stats["weighted_mloglik"] += np.bincount(
+            flat, weights=self._stats["weighted_mloglik"][select],
+            minlength=n_cells)
+        _minimum_at(grid._stats["min_mloglik"], flat,
+                    self._stats["min_mloglik"][select])
+        return grid
+    def save(self, filename):
+        """
+        Saves the cube to the given file (in 'numpy' '.npz' format).
+        """
+        self._consolidate()
+        with open(filename, "wb") as npz:
+            np.savez(npz, params=np.array(self._params),
+                     limits=np.array(self._limits), n_grid=self._n_grid,
+                     cells=self._cells, identity=np.array(self._identity),
+                     **self._stats)
+    def _add(self, groups):
+        self._pending.append(groups)
+        self._n_pending += len(groups[0])
+        # Merge the pending blocks once they are as big as the rest, so that
+        # the cost of the merges grows only linearly with the number of cells
+        if self._n_pending > max(self._cells.shape[0], 10**5):
+            self._consolidate()
+    def _consolidate(self):
+        if not self._pending:
+            return
+        groups = [(self._cells, self._stats["weights"],
+                   self._stats["weighted_mloglik"], self._stats["min_mloglik"])]
+        groups += self._pending
+        self._cells, weights, weighted_mloglik, min_mloglik = _group_rows(
+            *[np.concatenate(g) for g in zip(*groups)])
+        self._stats = {"weights": weights, "weighted_mloglik": weighted_mloglik,
+                       "min_mloglik": min_mloglik}
+        self._pending = []
+        self._n_pending = 0
+
+def build_likelihood_cube(chains, params=None, limits=None, n_grid=20,
+                          block_size=100000, use_index=False):
+    """
+    Bins the points of the given chains in a sparse N-dimensional grid over
+    the given parameters, in a single pass over them, and returns it as a
+    'LikelihoodCube'.
+
+    Mandatory arguments:
+    --------------------
+
+    chains: list of 'Chain' instances
+
+    Optional arguments:
+    -------------------
+
+    params: list of parameter names (default: None)
+        By default, all the parameters of the first chain.
+
+    limits: list of [min, max] (default: None)
+        Limits of the grid (see 'grid_limits'). Points outside are ignored.
+
+    n_grid: int (default: 20)
+        Number of cells along each parameter.
+
+    block_size: int (default: 100000)
+        Number of points binned at a time.
+
+    use_index: bool (default: False)
+        If True, only the points within the given limits are read, found with
+        'Chain.select' (see 'accumulate_likelihood').
+
+    """
+    if isinstance(chains, Chain):
+        chains = [chains]
+    if params is None:
+        params = chains[0].parameters()
+    params = list(params)
+    cube_limits = grid_limits(chains, params, limits)
+    cube = LikelihoodCube(params, cube_limits, n_grid)
+    for chain in _select_in_limits(chains, params, limits, cube_limits,
+                                   use_index):
+        cube.add_chain(chain, block_size=block_size)
+    cube._identity = _key_hash(tuple(chain.identity() for chain in chains))
+    cube._consolidate()
+    return cube
+
+def load_likelihood_cube(filename, chains=None):
+    """
+    Loads a 'LikelihoodCube' saved with its method 'save'.
+
+    If 'chains' are given, checks that the cube was built from them, and that
+    they have not changed since then, and raises 'ValueError' otherwise.
+    """
+    with np.load(filename) as npz:
+        cube = LikelihoodCube([str(p) for p in npz["params"]],
+                              npz["limits"].tolist(), int(npz["n_grid"]))
+        cube._cells = npz["cells"]
+        for field in cube._stats:
+            cube._stats[field] = npz[field]
+        cube._identity = str(npz["identity"])
+    if chains is not None:
+        if isinstance(chains, Chain):
+            chains = [chains]
+        if cube._identity != _key_hash(
+                tuple(chain.identity() for chain in chains)):
+            raise ValueError("The cube in '%s' was not built "%filename +
+                             "from the given chains, or they have changed.")
+    return cube
+
+def _group_rows(cells, weights, weighted_mloglik, min_mloglik):
+    """
+    Groups the given statistics by cell (rows of 'cells'), and returns the
+    (sorted) unique cells, and the sums of the weights and weighted -loglik
+    and the minimum -loglik in each of them.
+    """
+    if not cells.shape[0]:
+        return cells, weights, weighted_mloglik, min_mloglik
+    order = np.lexsort(cells.T[::-1])
+    cells = cells[order]
+    new = np.concatenate([[True], (cells[1:] != cells[:-1]).any(axis=1)])
+    starts = np.flatnonzero(new)
+    return (cells[starts], np.add.reduceat(weights[order], starts),
+            np.add.reduceat(weighted_mloglik[order], starts),
+            np.minimum.reduceat(min_mloglik[order], starts))
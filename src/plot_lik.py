@@ -4,19 +4,185 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
-from math import floor
 
 # Local import
 from Chain import Chain
+from lik_grid import (grid_limits, bin_likelihood_triangle,
+                      bin_profile_adaptive, accumulate_likelihood,
+                      accumulate_likelihood_1D, credible_levels, gaussian_smooth,
+                      kde_weights, log_marginal,
+                      GridCache, default_grid_cache)
+
+### Plot of 1D likelihoods
+def plot_lik_1D(mode, chains, params,
+                # Main customisation parameters
+                labels=None, format="-loglik", central_mloglik=None,
+                limits=None, n_grid=100, n_workers=1, n_columns=3,
+                regions_show=True, save=True, axes=None, grid_cache=True,
+                cube=None,
+                # Fine tuning
+                fontsize_labels=18, fontsize_ticks=12,
+                padding=0.02, dpi=150, subplot_size=4,
+                transparent=False, transparent_frame=False,
+                line_color="black", line_thickness=1, line_style="-",
+                regions_color="0.5", regions_thickness=1, regions_style="--",
+                ):
+    """
+    Plots the [marginal|mean|profile] likelihood of the given chains
+    with respect to each of the given parameters, on a grid, meaning
+
+    * Mean:      (sum_i #_i * -loglik_i) / (sum_i #_i)
+    * Marginal:  sum_i #_i, normalised to a maximum of 1
+    * Profile:   max(-loglik_i)
+
+    being the sums over 'i' extended to all chain points falling within a given
+    cell, and being '#_i' the number of stops of the chain point 'i'.
+
+    The likelihoods of all the parameters are computed in a single pass over
+    the points of the chains (see 'lik_grid.bin_likelihood_1D').
+
+
+    Mandatory arguments:
+    --------------------
+
+    mode: one of ["marginal", "mean", "profile"]
+
+    chains: list of 'Chain' instances
+
+    params: parameter name, or list of them (e.g. 'chain.parameters()')
+
+
+    Main customisation parameters:
+    ------------------------------
+
+    labels: str, or list of str (default: None)
+        Alternative names of the parameters to show as axes labels.
+
+    format, central_mloglik, regions_show, grid_cache, cube:
+        As in 'plot_lik_2D'.
+
+    limits: list of [min, max] floats or None, one per parameter (default: None)
+        By default, the extrema of all the points in the chains are taken.
+
+    n_grid: int (default: 100)
+        Number of cells along each parameter.
+
+    n_workers: int (default: 1)
+        Number of processes used to bin the points.
+
+    n_columns: int (default: 3)
+        Number of columns of subplots, if more than one parameter is given.
+
+    save: bool or str (default: True, i.e. 'show()')
+        As in 'plot_lik_2D'. If False, returns the axes (an array of them if
+        more than one parameter is given) and the keyword dictionary for
+        'pyplot.savefig()'.
+
+    axes: matplotlib.axes.Axes, or list of them (default: None)
+        Allows to specify the axes in which the likelihoods must be plotted,
+        one per parameter.
+
+    Fine Tuninng Parameters:
+    ------------------------
+
+    fontsize_labels, fontsize_ticks, padding, dpi, transparent,
+    transparent_frame, regions_color, regions_thickness, regions_style:
+        As in 'plot_lik_2D'.
+
+    subplot_size: float (default: 4)
+        Size in inches of the side of each subplot (if no axes are given).
+
+    line_color="black", line_thickness=1, line_style="-"
+        Finely set the aspect of the likelihood curves.
+
+    """
+    # Make sense of input #####
+    if isinstance(chains, Chain):
+        chains = [chains]
+    single = not isinstance(params, (list, tuple))
+    if single:
+        params = [params]
+        labels = [labels] if labels else None
+        limits = [limits] if limits else None
+        axes = [axes] if axes else None
+    for chain in chains:
+        assert isinstance(chain, Chain), (
+            "The first argument must be a list of 'Chain' instances.")
+        for param in params:
+            assert chain.has_param(param), (
+                "The parameter %s is not on the chain %s."%(param, chain.name()))
+    if not labels:
+        labels = params
+    assert len(labels) == len(params), "There must be a label per parameter."
+    # All the likelihoods at once #####
+    if cube is not None:
+        limits_new, curves = [], {}
+        for i, param in enumerate(params):
+            grid = cube.project([param], [limits[i]] if limits else None)
+            limits_new += grid.limits()
+            curves[param] = grid.likelihood(mode)
+    else:
+        grids = accumulate_likelihood_1D(chains, params, limits, n_grid=n_grid,
+                                         n_workers=n_workers,
+                                         cache=_grid_cache(grid_cache))
+        limits_new = [grids[param].limits()[0] for param in params]
+        curves = dict((param, grids[param].likelihood(mode))
+                      for param in params)
+    # Create axes, in none given
+    if axes:
+        assert len(axes) == len(params), "There must be an axes per parameter."
+    else:
+        n_cols = min(len(params), n_columns)
+        n_rows = int(np.ceil(len(params) / float(n_cols)))
+        fig, axes_grid = plt.subplots(
+            n_rows, n_cols, squeeze=False,
+            figsize=(subplot_size*n_cols, 0.75*subplot_size*n_rows))
+        fig.frameon = not(transparent_frame or transparent)
+        axes = list(axes_grid.flatten())
+        for extra in axes[len(params):]:
+            extra.set_axis_off()
+        axes = axes[:len(params)]
+    # Plot #####
+    for param, label, lims, ax in zip(params, labels, limits_new, axes):
+        curve = _format_likelihood(curves[param], mode, format, central_mloglik)
+        edges = np.linspace(lims[0], lims[1], len(curve)+1)
+        ax.step(edges, np.append(curve, curve[-1]), where="post",
+                color=line_color, linewidth=1.5*line_thickness,
+                linestyle=line_style)
+        pad = padding*abs(lims[1]-lims[0])
+        limits_plot = [lims[0]-pad, lims[1]+pad]
+        ax.set_xlim(limits_plot[0], limits_plot[1])
+        ax.tick_params(labelsize=fontsize_ticks)
+        ax.set_xlabel(label, fontsize=fontsize_labels, fontweight="bold")
+        ax.set_ylabel(_likelihood_label(mode, format, log_marginal=False),
+                      fontsize=fontsize_labels, fontweight="bold")
+        # Show chain priors limits
+        if regions_show:
+            _plot_regions(ax, chains, [param], [limits_plot],
+                          regions_color, regions_thickness, regions_style)
+    plt.tight_layout()
+    # Plotting #####
+    options = {"dpi": int(dpi), "transparent": transparent,
+               "bbox_inches": "tight", "pad_inches": 0.1}
+    if isinstance(save, basestring):
+        plt.savefig(save, **options)
+        plt.close()
+    elif save:
+        plt.show()
+        plt.close()
+    else:
+        return (axes[0] if single else np.array(axes)), options
 
 ### Plot of 2D likelihoods
 def plot_lik_2D(mode, chains, params,
                 # Main customisation parameters
                 labels=None, format="-loglik", central_mloglik=None,
-                limits=None, n_grid=100, aspect=1,
+                limits=None, n_grid=100, aspect=1, adaptive=0,
                 color_map="jet_r", black_and_white=False,
                 cb_orientation="vertical",
-                bf_show=1, regions_show=True, save=True, axes=None,
+                bf_show=1, regions_show=True, contours=None, kde=False,
+                save=True, axes=None, grid_cache=True, cube=None,
+                use_index=False, verbose=False,
                 # Fine tuning
                 fontsize_labels=18, fontsize_ticks=12,
                 cb_ticks_formatter=None, cb_shrink=float(1),
@@ -25,6 +191,9 @@ def plot_lik_2D(mode, chains, params,
                 bf_alpha=1, bf_radius=1, bf_thickness=1,
                 bf_color_in="white", bf_color_out="black",
                 regions_color="0.5", regions_thickness=1, regions_style="--",
+                adaptive_min_points=10, adaptive_min_variation=0.5,
+                contours_smoothing=0, contours_color="black",
+                contours_thickness=1, contours_style="-",
                 ):
     """
     Plots the [marginal|mean|profile] likelihood of the given chains
@@ -65,7 +234,7 @@ def plot_lik_2D(mode, chains, params,
 
     format: str (default: "-loglik")
         Quantity to plot in the color map ("mean" and "profile")
-        and to print for the best fits:
+        and to print for the best fits (see 'verbose'):
             * '-loglik' for the log likelihood
             * 'delta-loglik' for the delta of the log likelihood with respect
                 to the central value 'central_mloglik', that must be specified
@@ -92,6 +261,13 @@ def plot_lik_2D(mode, chains, params,
     aspect: float (defalut: 1 -- square plot)
         Aspect ratio of the plot: height/width.
 
+    adaptive: int (default: 0)
+        If > 0 ("profile" only), the points are binned in an adaptive grid
+        (see 'lik_grid.bin_profile_adaptive'), whose coarsest cells can be
+        subdivided this number of times, only where they contain enough points
+        and the likelihood varies enough (see the fine tuning parameters
+        'adaptive_*'). The finest resolution is that given by 'n_grid'.
+
     color_map: str (default: "jet_r")
         A valid 'matplotlib' colormap
         (see e.g. http://wiki.scipy.org/Cookbook/Matplotlib/Show_colormaps ).
@@ -104,13 +280,26 @@ def plot_lik_2D(mode, chains, params,
         the use of a custom ticks formatter may be needed: use the keyword
 
     bf_show: int (default: 1)
-        If > 0, the best fit points are shown, either the overall (if 1) or that
-        of each of the chains (if 2).
+        If > 0, the best fit points are shown, either the overall (if 1), that
+        of each of the chains (if 2), or that of each of the chain files (if 3).
 
     regions_show: bool (default: True)
         If True, shows a rectangle (or the part of it within the plot limits)
         marking the border of the prior, if any.
 
+    contours: list of float, or True (default: None)
+        If given, overlays the contours of the highest-density credible
+        regions containing these fractions of the marginal posterior (in any
+        mode), e.g. [0.683, 0.954] (the default if True). See also the fine
+        tuning parameter 'contours_smoothing'.
+
+    kde: bool or float (default: False)
+        If True, the marginal likelihood (and the credible regions contours, in
+        any mode) is computed from a kernel density estimate: the grid of
+        weights is smoothed with a Gaussian kernel whose covariance is that of
+        the chains, scaled with Scott's rule (see 'lik_grid.kde_bandwidth').
+        If a number, it multiplies the width of the kernel.
+
     save: bool or str (default: True, i.e. 'show()')
         This keyword defines what to do with the resulting plot. Three outcomes
         are possible:
@@ -124,6 +313,31 @@ def plot_lik_2D(mode, chains, params,
         Allows to specify the axes in which the figure must be plotted.
         Useful for including the plot as a subplot in a bigger figure.
 
+    grid_cache: bool or 'lik_grid.GridCache' instance (default: True)
+        Cache of the binned points, so that plotting again the same chains,
+        parameters, limits and grid (e.g. with a different mode, format or
+        color map) does not bin them again. If True, a cache in memory shared
+        by all plots is used; a 'GridCache' instance can be given instead,
+        e.g. to keep the results on disk. If False, nothing is cached.
+        The best fits are kept by the chains themselves (also in streaming
+        mode), so that such a plot does not read the chain files again.
+
+    cube: 'lik_grid.LikelihoodCube' instance (default: None)
+        If given, the likelihood is projected from it instead of binning the
+        points of the chains (which are then only used for the best fits and
+        the prior regions, and can be an empty list). The grid is that of the
+        cube: 'n_grid' and 'aspect' are ignored, and the 'limits' are widened
+        to the nearest cell edges.
+
+    use_index: bool (default: False)
+        If True, and 'limits' are given, the points within them are found
+        through the sorted columns of the chains (see 'Chain.select'), which
+        pays off when zooming repeatedly into small regions of chains kept in
+        memory (see 'lik_grid.accumulate_likelihood').
+
+    verbose: bool (default: False)
+        If True, the best fits shown (see 'bf_show') are printed.
+
     Fine Tuninng Parameters:
     ------------------------
 
@@ -160,135 +374,108 @@ def plot_lik_2D(mode, chains, params,
     regions_color="0.5", regions_thickness=1, regions_style="--"
         Finely set the aspect of the prior ranges boxes.
 
+    adaptive_min_points=10, adaptive_min_variation=0.5
+        Minimum number of points in a cell, and minimum variation of -loglik
+        among them, for the cell to be subdivided (if 'adaptive' > 0).
+
+    contours_smoothing: float (default: 0)
+        If > 0, standard deviation, in units of cells, of the Gaussian kernel
+        with which the marginal posterior is smoothed before computing the
+        credible regions contours.
+
+    contours_color="black", contours_thickness=1, contours_style="-"
+        Finely set the aspect of the credible regions contours.
+
     """
     # Make sense of input #####
     if isinstance(chains, Chain):
         chains = [chains]
+    if adaptive:
+        assert mode == "profile", (
+            "The adaptive grid is only available in 'profile' mode.")
+        assert cube is None, "The adaptive grid cannot be used with a cube."
     for chain in chains:
         assert isinstance(chain, Chain), (
             "The first argument must be a list of 'Chain' instances.")
         for i in [0, 1]:
-            assert (params[i] in chain.varying_parameters() or 
-                    params[i] in chain.derived_parameters()), (
+            assert chain.has_param(params[i]), (
                 "The parameter %s is not on the chain %s."%(params[i], chain.name()))
     # Format of the color scale (profile and mean) and the best fit (all) #####
-    factor = 2 if "chisq" in format else 1
-    if "delta" in format:
-        assert central_mloglik, ("A central log-likehood must be specified" +
-                                 " if a 'delta'-like plot is requested.")
-        delta = -1*central_mloglik
-    else:
-        delta = 0
-    # Maxima and minima #####
-    limits_new = [[None, None], [None, None]]
-    if limits:
-        for i in [0, 1]:
-            if limits[i]:
-                for j in [0, 1]:
-                    limits_new[i][j] = limits[i][j]
-    for i in [0, 1]:
-        if limits_new[i][0] is None:
-            limits_new[i][0] = min([chain.get_min(params[i]) for chain in chains])
-            limits_new[i][1] = max([chain.get_max(params[i]) for chain in chains])
-    maxi = [limits_new[0][1], limits_new[1][1]]
-    mini = [limits_new[0][0], limits_new[1][0]]
-    assert maxi[0] > mini[0] and maxi[1] > mini[1],(
-        "The given limits are not well formatted: min > max.")
+    factor, delta = _format_factors(format, central_mloglik)
     # Subdivisions #####
     n_grid = abs(int(n_grid))
     dims = [n_grid, n_grid]
     short_side = 0 if aspect <= 1 else 1
     dims[short_side] = int(dims[short_side]/float(aspect))
-    # (notice the -1 in the "dims-1" in the next step)
-    steps = [(maxi[i]-mini[i])/float(dims[i]) for i in [0, 1]]
-    # Creating matrix #####
-    matrix = np.ones(shape=dims)
-    indices = [(i,j) for i in range(dims[0])
-                     for j in range(dims[1])]
-    if mode == "profile":
-        matrix = float("infinity") * matrix
-    elif mode == "mean":
-        matrix = 0*matrix
-        matrix_num = matrix.copy()
-    elif mode == "marginal":
-        matrix = 0 * matrix
-    # Function to find the appropriate cell
-    def to_matrix_element(p1value, p2value):
-        i, j = (int(floor((p1value - mini[0]) / float(steps[0]))),
-                int(floor((p2value - mini[1]) / float(steps[1]))))
-        # Handling extremes
-        if i == dims[0]:
-            i -= 1
-        if j == dims[1]:
-            j -= 1
-        return i, j
+    # Get the points into the grid, which also gives its limits #####
+    grid = None
+    if cube is not None:
+        grid = cube.project(params, limits)
+    elif contours or kde or not adaptive:
+        grid = accumulate_likelihood(chains, params, limits, dims,
+                                     cache=_grid_cache(grid_cache),
+                                     use_index=use_index)
+    # Maxima and minima #####
+    if grid is not None:
+        limits_new = grid.limits()
+    else:
+        limits_new = grid_limits(chains, params, limits)
+    maxi = [limits_new[0][1], limits_new[1][1]]
+    mini = [limits_new[0][0], limits_new[1][0]]
     # Get the points into the matrix #####
-    for chain in chains:
-        for num, mloglik, p1value, p2value in zip(chain.points("#"),
-                                                  chain.points("mloglik"),
-                                                  chain.points(params[0]),
-                                                  chain.points(params[1])):
-            if (p1value < mini[0] or p1value > maxi[0] or
-                p2value < mini[1] or p2value > maxi[1]):
-                continue
-            i, j = to_matrix_element(p1value, p2value)
-            if mode == "profile":
-                matrix[i,j] = min(mloglik, matrix[i,j])
-            elif mode == "mean":
-                matrix[i,j] += mloglik*num
-                matrix_num[i,j] += num
-            elif mode == "marginal":
-                matrix[i,j] += num
-    # Log and clipping of the marginal matrix
-    if mode == "marginal":
-        matrix = np.log(np.e*matrix)
-        maxlogsteps = matrix.max()
-        matrix = matrix.clip(-maxlogsteps, maxlogsteps)
-    # Normalising the "mean" matrix:
-    # (and filling with infinities to treat is as the profile one)
-    if mode == "mean":
-        for i, j in indices:
-            if matrix_num[i, j] == 0:
-                matrix[i, j] = float("infinity")
-            else:
-                matrix[i, j] /= matrix_num[i, j]
+    # Kernel density estimate of the marginal
+    weights = None
+    if kde:
+        weights = kde_weights(grid, chains, 1. if kde is True else kde)
+    if adaptive:
+        cells, matrix = bin_profile_adaptive(
+            chains, params, limits_new, dims, levels=adaptive,
+            min_points=adaptive_min_points,
+            min_variation=adaptive_min_variation,
+            cache=_grid_cache(grid_cache))
+    elif mode == "marginal" and weights is not None:
+        matrix = log_marginal(weights)
+    else:
+        matrix = grid.likelihood(mode)
     # Centering and reducing the range  -- infinity to NaN
-    if mode in ["profile", "mean"]:
-        if central_mloglik:
-            maxloglik = matrix.min()
-            assert central_mloglik > maxloglik, (
-                "The central -loglik value provided, %e, "%central_mloglik +
-                "is smaller than the maximum -loglik, %e"%maxloglik)
-            minloglik = central_mloglik - (maxloglik - central_mloglik)
-        else:
-            minloglik = float("infinity")
-        for i, j in indices:
-            if matrix[i, j] == float("infinity"):
-                matrix[i, j] = float("nan")
-            else:
-                matrix[i, j] = min(matrix[i, j], minloglik)
-                if "delta" in format:
-                    matrix[i, j] -= central_mloglik
-                if "chisq" in format:
-                    matrix[i, j] *= 2
+    matrix = _format_likelihood(matrix, mode, format, central_mloglik)
     # Plot #####
-    # The matrix must be transposed: the 0th component is the x axis
-    matrix = matrix.transpose()
     # Create axes, in none given
     if not(axes):
         fig = plt.figure()
         fig.frameon = not(transparent_frame or transparent)
         axes  = plt.axes()
     sq_aspect =  (maxi[0] - mini[0]) / (maxi[1] - mini[1])
-    if mode == "marginal":
-        if color_map[-2:] == "_r":
-            color_map = color_map[:-2]
-        else:
-            color_map += "_r"
-    cmap = "gray" if black_and_white else color_map
-    imsh = axes.imshow(matrix, cmap=cmap, interpolation="nearest", origin="lower",
-                      aspect=aspect*sq_aspect, zorder=0,
-                      extent = (mini[0], maxi[0], mini[1], maxi[1]))
+    cmap = _color_map(mode, color_map, black_and_white)
+    if adaptive:
+        # Cells of different sizes: a rectangle each
+        from matplotlib.collections import PolyCollection
+        corners = np.array([cells[:, [0, 1, 1, 0]], cells[:, [2, 2, 3, 3]]])
+        imsh = PolyCollection(corners.transpose((1, 2, 0)), cmap=cmap,
+                              edgecolors="none", linewidths=0,
+                              antialiaseds=False, zorder=0)
+        imsh.set_array(matrix)
+        axes.add_collection(imsh)
+        axes.set_aspect(aspect*sq_aspect)
+    else:
+        # The matrix must be transposed: the 0th component is the x axis
+        imsh = axes.imshow(matrix.transpose(), cmap=cmap,
+                           interpolation="nearest", origin="lower",
+                           aspect=aspect*sq_aspect, zorder=0,
+                           extent = (mini[0], maxi[0], mini[1], maxi[1]))
+    # Credible regions contours #####
+    if contours:
+        fractions = [0.683, 0.954] if contours is True else contours
+        if weights is None:
+            weights = grid.weights()
+        if contours_smoothing:
+            weights = gaussian_smooth(weights, contours_smoothing)
+        levels = np.unique(credible_levels(weights, fractions))
+        centres = [np.linspace(limits_new[k][0], limits_new[k][1],
+                               2*weights.shape[k]+1)[1::2] for k in [0, 1]]
+        axes.contour(centres[0], centres[1], weights.transpose(), levels=levels,
+                     colors=contours_color, linewidths=1.5*contours_thickness,
+                     linestyles=contours_style, zorder=2)
     paddings = [padding*abs(limits_new[i][1]-limits_new[i][0]) for i in [0, 1]]
     paddings[short_side] = paddings[short_side]*float(aspect)
     limits_plot = [[limits_new[0][0]-paddings[0], limits_new[0][1]+paddings[0]],
@@ -303,81 +490,33 @@ def plot_lik_2D(mode, chains, params,
     axes.set_xlabel(labels[0], fontsize = fontsize_labels, fontweight = "bold")
     axes.set_ylabel(labels[1], fontsize = fontsize_labels, fontweight = "bold")
     # Color bar #####
-    cb_options = {}
-    assert cb_orientation in ["horizontal", "vertical"], (
-        "The keyword 'cb_orientation' must be 'horizontal' or 'vertical'")
-    cb_options["orientation"] = cb_orientation
-    if cb_orientation == "horizontal":
-        cb_options["pad"] = 0.125
-        cb_options["fraction"] = 0.05
-        cb_options["shrink"] = 1
-    elif cb_orientation == "vertical":
-        cb_options["shrink"] = aspect+2*padding
-    cb_options["shrink"] *= cb_shrink
-    if cb_ticks_formatter:
-        cb_options["format"]=cb_ticks_formatter
-    cb = plt.colorbar(imsh, ax=axes, **cb_options)
-    cb.ax.tick_params(labelsize=fontsize_ticks)
-    if mode in ["profile", "mean"]:
-        cb_label = "\ln\mathcal{L}"
-        if "delta" in format:
-            cb_label = "\Delta"+cb_label
-        if "chisq" in format:
-            cb_label = "2\,"+cb_label
-        cb_label = r"$-%s$"%cb_label
-    if mode == "marginal":
-        cb_label = r"$\propto\log\left(\#\mathrm{steps}\right)$"
-    cb.set_label(cb_label, fontsize = fontsize_labels, fontweight = "bold")
+    _color_bar(imsh, axes, mode, format, cb_orientation, cb_shrink,
+               aspect+2*padding, cb_ticks_formatter,
+               fontsize_labels, fontsize_ticks)
     # Show best fit markers #####
-# TODO: Fix this!
-#    if bf_show:
-#        bfs = {}
-#        for chain in chains:
-#            bfs[chain.name()] = [[b[chain.index_of_param(a)]
-#                for a in ["mloglik", params[0], params[1]]]
-#            for b in  chain.best_fit(more_than_one=True)]
-#        bf_plot = [item for sublist in bfs.values() for item in sublist]
-#        if bf_show == 1:
-#            bf_plot = [sorted(bf_plot, key=lambda x: x[0])[0]]
-#        # Plot them
-#        for bf in bf_plot:
-#            axes.scatter([bf[1]],[bf[2]], s=80*bf_radius, alpha=bf_alpha,
-#                        edgecolor=bf_color_out, facecolor=bf_color_in,
-#                        linewidths=1.5*bf_thickness)
-#            print "Best fit: % .6e ; %s = % .6e  ; %s = % .6e"%(
-#                factor*(bf[0]+delta), params[0], bf[1], params[1], bf[2])
+    if bf_show and chains:
+        bf_params = ["mloglik", params[0], params[1]]
+        bf_plot = []
+        for chain in chains:
+            if bf_show == 3:
+                bf_plot += [bf[0] for bf in chain.best_fit(
+                    params=bf_params, per_file=True).values()]
+            else:
+                bf_plot.append(chain.best_fit(params=bf_params)[0])
+        if bf_show == 1:
+            bf_plot = [min(bf_plot, key=lambda x: x[0])]
+        # Plot them
+        for bf in bf_plot:
+            axes.scatter([bf[1]],[bf[2]], s=80*bf_radius, alpha=bf_alpha,
+                        edgecolor=bf_color_out, facecolor=bf_color_in,
+                        linewidths=1.5*bf_thickness)
+            if verbose:
+                print("Best fit: % .6e ; %s = % .6e  ; %s = % .6e"%(
+                    factor*(bf[0]+delta), params[0], bf[1], params[1], bf[2]))
     # Show chain priors limits #####
     if regions_show:
-        for chain in chains:
-            limits = [[chain.get_limits(params[i])[j] for j in [0, 1]] for i in [0, 1]]
-            # Left
-            if limits[0][0] >= limits_plot[0][0]:
-                axes.plot([limits[0][0], limits[0][0]],
-                         [max(limits[1][0], limits_plot[1][0]),
-                          min(limits[1][1], limits_plot[1][1])],
-                         color=regions_color, linewidth=2*regions_thickness,
-                         linestyle=regions_style, zorder=1)
-            # Right
-            if limits[0][1] <= limits_plot[0][1]:
-                axes.plot([limits[0][1], limits[0][1]],
-                         [max(limits[1][0], limits_plot[1][0]),
-                          min(limits[1][1], limits_plot[1][1])],
-                         color=regions_color, linewidth=2*regions_thickness,
-                         linestyle=regions_style, zorder=1)
-            # Bottom
-            if limits[1][0] >= limits_plot[1][0]:
-                axes.plot([max(limits[0][0], limits_plot[0][0]),
-                          min(limits[0][1], limits_plot[0][1])],
-                         [limits[1][0], limits[1][0]],
-                         color=regions_color, linewidth=2*regions_thickness,
-                         linestyle=regions_style, zorder=1)
-            # Top
-            if limits[1][1] <= limits_plot[1][1]:
-                axes.plot([max(limits[0][0], limits_plot[0][0]),
-                          min(limits[0][1], limits_plot[0][1])],
-                         [limits[1][1], limits[1][1]],
-                         color=regions_color, linewidth=2*regions_thickness,
-                         linestyle=regions_style, zorder=1)
+        _plot_regions(axes, chains, params, limits_plot,
+                      regions_color, regions_thickness, regions_style)
     # Ticks #####
     from matplotlib.ticker import AutoMinorLocator
     axes.xaxis.set_minor_locator(AutoMinorLocator(10))
@@ -397,3 +536,374 @@ def plot_lik_2D(mode, chains, params,
     # Return
     else:
         return axes, options
+
+### Triangle plot of 1D and 2D likelihoods
+def plot_lik_triangle(modes, chains, params,
+                      # Main customisation parameters
+                      labels=None, format="-loglik", central_mloglik=None,
+                      limits=None, n_grid=50, n_workers=1,
+                      color_map="jet_r", black_and_white=False,
+                      cb_orientation="vertical",
+                      regions_show=True, save=True, grid_cache=True,
+                      cube=None,
+                      # Fine tuning
+                      fontsize_labels=14, fontsize_ticks=8,
+                      cb_ticks_formatter=None, cb_shrink=float(1),
+                      padding=0.02, dpi=150, subplot_size=2.5,
+                      transparent=False, transparent_frame=False,
+                      line_color="black", line_thickness=1,
+                      regions_color="0.5", regions_thickness=1, regions_style="--",
+                      ):
+    """
+    Triangle plot of the [marginal|mean|profile] likelihood of the given chains
+    (see 'plot_lik_2D'): the 2D likelihood of every pair of the given parameters
+    below the diagonal, and the 1D one of each parameter on the diagonal.
+
+    All the 1D and 2D grids, for all the requested modes, are computed in a
+    single pass over the points of the chains, block by block, and optionally
+    spread over a number of processes (see 'lik_grid.bin_likelihood_triangle').
+
+    All the 2D plots share the same color scale. On the diagonal, the marginal
+    likelihood is normalised to its maximum.
+
+
+    Mandatory arguments:
+    --------------------
+
+    modes: one of ["marginal", "mean", "profile"], or a list of them
+        If more than one, a figure is produced for each of them.
+
+    chains: list of 'Chain' instances
+
+    params: list of 2 or more parameter names
+
+
+    Main customisation parameters:
+    ------------------------------
+
+    labels: list of str (default: None)
+        Alternative names of the parameters to show as axes labels.
+
+    format, central_mloglik, color_map, black_and_white, cb_orientation,
+    regions_show, grid_cache, cube:
+        As in 'plot_lik_2D'.
+
+    limits: list of [min, max] floats or None, one per parameter (default: None)
+        By default, the extrema of all the points in the chains are taken.
+
+    n_grid: int (default: 50)
+        Number of cells along each parameter.
+
+    n_workers: int (default: 1)
+        Number of processes used to bin the points.
+
+    save: bool or str (default: True, i.e. 'show()')
+        As in 'plot_lik_2D'. If more than one mode is given, the file name
+        must contain a '%s', which is substituted by the name of each mode.
+        If False, returns the 2D array of axes (None above the diagonal) and
+        the keyword dictionary for 'pyplot.savefig()' -- a list of such
+        tuples, one per mode, if more than one mode is given.
+
+    Fine Tuninng Parameters:
+    ------------------------
+
+    fontsize_labels, fontsize_ticks, cb_ticks_formatter, cb_shrink, padding,
+    dpi, transparent, transparent_frame, regions_color, regions_thickness,
+    regions_style:
+        As in 'plot_lik_2D'.
+
+    subplot_size: float (default: 2.5)
+        Size in inches of the side of each subplot.
+
+    line_color="black", line_thickness=1
+        Finely set the aspect of the 1D likelihoods.
+
+    """
+    # Make sense of input #####
+    if isinstance(chains, Chain):
+        chains = [chains]
+    single_mode = not isinstance(modes, (list, tuple))
+    if single_mode:
+        modes = [modes]
+    for mode in modes:
+        assert mode in ["marginal", "mean", "profile"], (
+            "Mode not recognised: '%s'."%mode)
+    assert len(params) >= 2, "At least 2 parameters must be given."
+    for chain in chains:
+        assert isinstance(chain, Chain), (
+            "The first argument must be a list of 'Chain' instances.")
+        for param in params:
+            assert chain.has_param(param), (
+                "The parameter %s is not on the chain %s."%(param, chain.name()))
+    if not labels:
+        labels = params
+    assert len(labels) == len(params), "There must be a label per parameter."
+    if isinstance(save, basestring) and not single_mode:
+        assert "%s" in save, ("If more than one mode is given, the file name" +
+                              " must contain a '%s'.")
+    # All the grids at once #####
+    n = len(params)
+    if cube is not None:
+        grids_1D = dict((param, cube.project([param], [limits[i]] if limits
+                                             else None))
+                        for i, param in enumerate(params))
+        grids_2D = dict(((params[k], params[l]), cube.project(
+                            [params[k], params[l]],
+                            [limits[k], limits[l]] if limits else None))
+                        for k in range(n) for l in range(k+1, n))
+        limits_new = [grids_1D[param].limits()[0] for param in params]
+    else:
+        limits_new, grids_1D, grids_2D = bin_likelihood_triangle(
+            chains, params, limits, n_grid=n_grid, n_workers=n_workers,
+            cache=_grid_cache(grid_cache))
+    paddings = [padding*abs(limits_new[i][1]-limits_new[i][0]) for i in range(n)]
+    limits_plot = [[limits_new[i][0]-paddings[i], limits_new[i][1]+paddings[i]]
+                   for i in range(n)]
+    options = {"dpi": int(dpi), "transparent": transparent,
+               "bbox_inches": "tight", "pad_inches": 0.1}
+    returned = []
+    for mode in modes:
+        # Likelihoods #####
+        curves = {}
+        for param in params:
+            curves[param] = _format_likelihood(
+                grids_1D[param].likelihood(mode), mode, format, central_mloglik)
+        matrices = {}
+        for pair in grids_2D:
+            matrices[pair] = _format_likelihood(
+                grids_2D[pair].likelihood(mode), mode, format, central_mloglik)
+        # Common color scale
+        vmin = np.nanmin([np.nanmin(m) for m in matrices.values()])
+        vmax = np.nanmax([np.nanmax(m) for m in matrices.values()])
+        # Plot #####
+        fig, axes_grid = plt.subplots(n, n, squeeze=False,
+                                      figsize=(subplot_size*n, subplot_size*n))
+        fig.frameon = not(transparent_frame or transparent)
+        fig.subplots_adjust(hspace=0.05, wspace=0.05)
+        cmap = _color_map(mode, color_map, black_and_white)
+        axes_returned = np.empty((n, n), dtype=object)
+        for i in range(n):
+            for j in range(n):
+                axes = axes_grid[i, j]
+                if j > i:
+                    axes.set_axis_off()
+                    continue
+                axes_returned[i, j] = axes
+                axes.set_xlim(limits_plot[j][0], limits_plot[j][1])
+                if i == j:
+                    # 1D likelihood on the diagonal
+                    edges = np.linspace(limits_new[i][0], limits_new[i][1],
+                                        len(curves[params[i]])+1)
+                    axes.step(edges, np.append(curves[params[i]],
+                                               curves[params[i]][-1]),
+                              where="post", color=line_color,
+                              linewidth=1.5*line_thickness)
+                    axes.set_yticks([])
+                    if regions_show:
+                        _plot_regions(axes, chains, [params[i]],
+                                      limits_plot[i:i+1], regions_color,
+                                      regions_thickness, regions_style)
+                else:
+                    # 2D likelihood below the diagonal (x: column, y: row)
+                    imsh = axes.imshow(matrices[(params[j], params[i])].transpose(),
+                                       cmap=cmap, interpolation="nearest",
+                                       origin="lower", aspect="auto", zorder=0,
+                                       vmin=vmin, vmax=vmax,
+                                       extent=(limits_new[j][0], limits_new[j][1],
+                                               limits_new[i][0], limits_new[i][1]))
+                    axes.set_ylim(limits_plot[i][0], limits_plot[i][1])
+                    if regions_show:
+                        _plot_regions(axes, chains, [params[j], params[i]],
+                                      [limits_plot[j], limits_plot[i]],
+                                      regions_color, regions_thickness,
+                                      regions_style)
+                # Labels and ticks only on the outer subplots
+                axes.tick_params(labelsize=fontsize_ticks)
+                if i == n-1:
+                    axes.set_xlabel(labels[j], fontsize=fontsize_labels,
+                                    fontweight="bold")
+                else:
+                    axes.set_xticklabels([])
+                if j == 0 and i > 0:
+                    axes.set_ylabel(labels[i], fontsize=fontsize_labels,
+                                    fontweight="bold")
+                elif i != j:
+                    axes.set_yticklabels([])
+        # Color bar, in the empty upper triangle #####
+        top_right = axes_grid[0, n-1].get_position()
+        if cb_orientation == "vertical":
+            bottom = axes_grid[n-2, n-1].get_position().y0
+            length = (top_right.y1 - bottom) * cb_shrink
+            cax = fig.add_axes([top_right.x0 + 0.5*top_right.width,
+                                top_right.y1 - length,
+                                0.1*top_right.width, length])
+        else:
+            left = axes_grid[0, 1].get_position().x0
+            length = (top_right.x1 - left) * cb_shrink
+            cax = fig.add_axes([top_right.x1 - length,
+                                top_right.y0 + 0.5*top_right.height,
+                                length, 0.1*top_right.height])
+        _color_bar(imsh, None, mode, format, cb_orientation, cb_shrink, 1,
+                   cb_ticks_formatter, fontsize_labels, fontsize_ticks, cax=cax)
+        # Plotting #####
+        if isinstance(save, basestring):
+            plt.savefig(save if single_mode else save%mode, **options)
+            plt.close()
+        elif save:
+            plt.show()
+            plt.close()
+        else:
+            returned.append((axes_returned, options))
+    if not save:
+        return returned[0] if single_mode else returned
+
+### Helpers shared by the plotting functions
+def _grid_cache(grid_cache):
+    """
+    Cache of binned points to be used, given the value of 'grid_cache'.
+    """
+    if isinstance(grid_cache, GridCache):
+        return grid_cache
+    return default_grid_cache if grid_cache else None
+
+def _format_factors(format, central_mloglik):
+    """
+    Returns the factor and the shift to be applied to a -loglik to get the
+    requested 'format' (see 'plot_lik_2D'): 'factor * (mloglik + delta)'.
+    """
+    factor = 2 if "chisq" in format else 1
+    if "delta" in format:
+        assert central_mloglik, ("A central log-likehood must be specified" +
+                                 " if a 'delta'-like plot is requested.")
+        delta = -1*central_mloglik
+    else:
+        delta = 0
+    return factor, delta
+
+def _format_likelihood(matrix, mode, format, central_mloglik):
+    """
+    Centres and reduces the range of a grid of likelihood values ("mean" and
+    "profile"), transforms them to the requested 'format', and sets the empty
+    cells to NaN.
+    """
+    if mode in ["profile", "mean"]:
+        empty = np.isinf(matrix)
+        if central_mloglik:
+            maxloglik = matrix.min()
+            assert central_mloglik > maxloglik, (
+                "The central -loglik value provided, %e, "%central_mloglik +
+                "is smaller than the maximum -loglik, %e"%maxloglik)
+            minloglik = central_mloglik - (maxloglik - central_mloglik)
+            matrix = np.minimum(matrix, minloglik)
+        if "delta" in format:
+            matrix = matrix - central_mloglik
+        if "chisq" in format:
+            matrix = matrix * 2
+        matrix[empty] = float("nan")
+    return matrix
+
+def _color_map(mode, color_map, black_and_white):
+    """
+    Color map for the given mode: for the marginal likelihood (where larger is
+    better) the given one is reversed.
+    """
+    if mode == "marginal":
+        if color_map[-2:] == "_r":
+            color_map = color_map[:-2]
+        else:
+            color_map += "_r"
+    return "gray" if black_and_white else color_map
+
+def _color_bar(imsh, axes, mode, format, cb_orientation, cb_shrink,
+               vertical_shrink, cb_ticks_formatter,
+               fontsize_labels, fontsize_ticks, cax=None):
+    """
+    Draws a labelled color bar for the image 'imsh' next to 'axes', or inside
+    'cax' if given.
+    """
+    cb_options = {}
+    assert cb_orientation in ["horizontal", "vertical"], (
+        "The keyword 'cb_orientation' must be 'horizontal' or 'vertical'")
+    cb_options["orientation"] = cb_orientation
+    if cax:
+        cb_options["cax"] = cax
+    else:
+        if cb_orientation == "horizontal":
+            cb_options["pad"] = 0.125
+            cb_options["fraction"] = 0.05
+            cb_options["shrink"] = 1
+        elif cb_orientation == "vertical":
+            cb_options["shrink"] = vertical_shrink
+        cb_options["shrink"] *= cb_shrink
+        cb_options["ax"] = axes
+    if cb_ticks_formatter:
+        cb_options["format"]=cb_ticks_formatter
+    cb = plt.colorbar(imsh, **cb_options)
+    cb.ax.tick_params(labelsize=fontsize_ticks)
+    cb.set_label(_likelihood_label(mode, format),
+                 fontsize = fontsize_labels, fontweight = "bold")
+    return cb
+
+def _likelihood_label(mode, format, log_marginal=True):
+    """
+    Label of the plotted likelihood values (color bar or y axis).
+    """
+    if mode in ["profile", "mean"]:
+        label = "\ln\mathcal{L}"
+        if "delta" in format:
+            label = "\Delta"+label
+        if "chisq" in format:
+            label = "2\,"+label
+        return r"$-%s$"%label
+    if log_marginal:
+        return r"$\propto\log\left(\#\mathrm{steps}\right)$"
+    return r"$\propto\#\mathrm{steps}$"
+
+def _plot_regions(axes, chains, params, limits_plot,
+                  regions_color, regions_thickness, regions_style):
+    """
+    Marks the borders of the priors of the chains that fall within the plot
+    limits: a rectangle (or part of it) for 2 parameters, or vertical lines for
+    a single one.
+    """
+    line_options = {"color": regions_color, "linewidth": 2*regions_thickness,
+                    "linestyle": regions_style, "zorder": 1}
+    for chain in chains:
+        # No limit (or a derived parameter): infinite
+        limits = []
+        for param in params:
+            if chain.has_param(param) and param in chain.varying_parameters():
+                limits.append(chain.get_limits(param))
+            else:
+                limits.append([None, None])
+            limits[-1] = [-np.inf if limits[-1][0] is None else limits[-1][0],
+                          np.inf if limits[-1][1] is None else limits[-1][1]]
+        if len(params) == 1:
+            for limit in limits[0]:
+                if limits_plot[0][0] <= limit <= limits_plot[0][1]:
+                    axes.axvline(limit, **line_options)
+            continue
+        # Left
+        if limits[0][0] >= limits_plot[0][0]:
+            axes.plot([limits[0][0], limits[0][0]],
+                     [max(limits[1][0], limits_plot[1][0]),
+                      min(limits[1][1], limits_plot[1][1])],
+                     **line_options)
+        # Right
+        if limits[0][1] <= limits_plot[0][1]:
+            axes.plot([limits[0][1], limits[0][1]],
+                     [max(limits[1][0], limits_plot[1][0]),
+                      min(limits[1][1], limits_plot[1][1])],
+                     **line_options)
+        # Bottom
+        if limits[1][0] >= limits_plot[1][0]:
+            axes.plot([max(limits[0][0], limits_plot[0][0]),
+                      min(limits[0][1], limits_plot[0][1])],
+                     [limits[1][0], limits[1][0]],
+                     **line_options)
+        # Top
+        if limits[1][1] <= limits_plot[1][1]:
+            axes.plot([max(limits[0][0], limits_plot[0][0]),
+                      min(limits[0][1], limits_plot[0][1])],
+                     [limits[1][1], limits[1][1]],
+                     **line_options)
@@ -0,0 +1,158 @@
+###########################################################
+# Fast reader of the whitespace-separated tables of floats #
+# written by MontePython, CosmoMC, CLASS and CAMB          #
+###########################################################
+
+import os
+from io import BytesIO
+import numpy as np
+
+# Size of the pieces in which big files are read and converted
+CHUNK_SIZE = 2**26
+
+# Since numpy 1.23, 'loadtxt' is implemented in C and it is faster than the
+# conversion used here, so it is used instead
+_C_LOADTXT = tuple(int(v) for v in np.__version__.split(".")[:2]) >= (1, 23)
+
+def read_table(filename, comments="#", chunk_size=CHUNK_SIZE,
+               offset=0, complete_lines=False):
+    """
+    Reads a table of floats separated by whitespace (e.g. a chain file or a
+    CMB spectrum), and returns it as a 2D array, one row per line.
+
+    Equivalent to 'numpy.loadtxt(filename, ndmin=2)', but much faster: the file
+    is read in big chunks, whose numbers are converted all at once by numpy.
+    (With numpy >= 1.23, whose 'loadtxt' is already fast, the latter is used,
+    on all the lines at once.)
+
+    Arguments:
+    ----------
+
+    filename: str
+        Name of the file to be read.
+
+    comments: str (default: "#")
+        Lines starting with this string (leading whitespace ignored) are
+        skipped, e.g. the headers written by CLASS.
+
+    chunk_size: int (default: 64MB)
+        Approximate size, in bytes, of the pieces in which the file is read.
+        It bounds the memory used in addition to that of the result.
+
+    offset: int (default: 0)
+        Position in the file (in bytes) at which the reading starts.
+
+    complete_lines: bool (default: False)
+        If True, a last line not terminated by a newline (e.g. one still being
+        written) is ignored, and a tuple '(table, end)' is returned, where 'end'
+        is the position right after the last line read, i.e. the 'offset' from
+        which to read the lines appended later to the file.
+
+    """
+    if _C_LOADTXT and os.path.getsize(filename) > offset:
+        if not offset and not complete_lines:
+            return np.loadtxt(filename, comments=comments, ndmin=2)
+        # A single conversion of all the (complete) lines is the fastest
+        chunk_size = max(chunk_size, os.path.getsize(filename) - offset)
+    tables = []
+    n_columns = None
+    end = offset
+    with open(filename, "rb") as tfile:
+        tfile.seek(offset)
+        remainder = b""
+        while True:
+            chunk = tfile.read(chunk_size)
+            data = remainder + chunk
+            if chunk or complete_lines:
+                # Only whole lines; the rest is left for the next chunk
+                last_newline = data.rfind(b"\n")
+                if last_newline == -1:
+                    remainder = data
+                    if chunk:
+                        continue
+                    break
+                data, remainder = data[:last_newline+1], data[last_newline+1:]
+            end += len(data)
+            table = parse_table(data, comments=comments, n_columns=n_columns)
+            if table.size:
+                n_columns = table.shape[1]
+                tables.append(table)
+            if not chunk:
+                break
+    if not tables:
+        table = np.empty(shape=(0, n_columns or 0))
+    elif len(tables) == 1:
+        table = tables[0]
+    else:
+        table = np.concatenate(tables)
+    if complete_lines:
+        return table, end
+    return table
+
+def parse_table(data, comments="#", n_columns=None):
+    """
+    Converts a string (bytes) containing a table of floats separated by
+    whitespace into a 2D array, one row per line.
+
+    Lines starting with 'comments' are skipped. If 'n_columns' is not given,
+    it is taken from the first line with data.
+    """
+    if comments:
+        data = _strip_comments(data, comments.encode("ascii"))
+    if not data or data.isspace():
+        return np.empty(shape=(0, n_columns or 0))
+    if _C_LOADTXT:
+        # It checks that all the lines have the same number of columns itself
+        values = np.loadtxt(BytesIO(data), ndmin=2)
+        if n_columns is not None and values.shape[1] != n_columns:
+            raise ValueError("The table is malformed: %d columns instead of "
+                             "%d."%(values.shape[1], n_columns))
+        return values
+    if n_columns is None:
+        n_columns = len(data.lstrip().split(b"\n", 1)[0].split())
+    values = np.fromstring(data, sep=" ")
+    columns = _columns_per_line(data)
+    wrong = np.flatnonzero(columns != n_columns)
+    if len(wrong):
+        raise ValueError("The table is malformed: the line %d with data has "
+                         "%d columns instead of %d."%(
+                             wrong[0] + 1, columns[wrong[0]], n_columns))
+    if values.size != columns.sum():
+        raise ValueError("The table is malformed: some line contains "
+                         "something other than numbers.")
+    return values.reshape((-1, n_columns))
+
+def _strip_comments(data, comments):
+    """
+    Removes the lines starting with 'comments'.
+    """
+    if comments not in data:
+        return data
+    # Usual case (CLASS, CAMB): a header at the top of the file
+    lines = data.split(b"\n")
+    for i, line in enumerate(lines):
+        if line.strip() and not line.lstrip().startswith(comments):
+            break
+    else:
+        return b""
+    rest = b"\n".join(lines[i:])
+    if comments not in rest:
+        return rest
+    return b"\n".join(line for line in lines[i:]
+                      if not line.lstrip().startswith(comments))
+
+def _columns_per_line(data):
+    """
+    Number of whitespace-separated fields in each non-blank line, counted at
+    once for all the lines.
+    """
+    chars = np.frombuffer(data, dtype=np.uint8)
+    space = ((chars == ord(" ")) | (chars == ord("\t")) |
+             (chars == ord("\n")) | (chars == ord("\r")))
+    # Beginning of each field, and the line it is in
+    starts = ~space
+    starts[1:] &= space[:-1]
+    lines = np.searchsorted(np.flatnonzero(chars == ord("\n")),
+                            np.flatnonzero(starts))
+    columns = np.bincount(lines)
+    return columns[columns > 0]